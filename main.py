@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import asyncio
-import signal
 import sys
 from pathlib import Path
 
@@ -10,16 +9,24 @@ from src.config import config
 from src.bot import TelegramBot
 
 
-def signal_handler(_signum, _frame):
-    print("\nReceived interrupt signal, shutting down...")
-    sys.exit(0)
+def install_event_loop() -> None:
+    """优先使用uvloop作为事件循环（Windows不支持，未安装时使用默认循环）"""
+    if sys.platform == "win32":
+        return
+
+    try:
+        import uvloop
+    except ImportError:
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 def main():
     bot = TelegramBot()
 
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    # SIGINT/SIGTERM 和退出前的清理都由 bot.start() 在事件循环上处理
+    install_event_loop()
 
     try:
         asyncio.run(bot.start())
@@ -27,8 +34,6 @@ def main():
         print("\nKeyboard interrupt received, shutting down...")
     except Exception as e:
         print(f"Bot error: {e}")
-    finally:
-        bot.stop()
 
 
 if __name__ == "__main__":
@@ -10,13 +10,13 @@ import os
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from tests.test_daily_summary import TestDailySummary
 
 
 def run_tests():
     """运行所有测试"""
     # 创建测试套件
-    suite = unittest.TestLoader().loadTestsFromTestCase(TestDailySummary)
+    tests_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests')
+    suite = unittest.TestLoader().discover(tests_dir, top_level_dir=os.path.dirname(tests_dir))
 
     # 运行测试
     runner = unittest.TextTestRunner(verbosity=2)
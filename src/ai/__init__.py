@@ -1,3 +1,4 @@
 from .summary import AISummary
+from .batch import BatchDispatcher, BatchRequestError
 
-__all__ = ['AISummary']
\ No newline at end of file
+__all__ = ['AISummary', 'BatchDispatcher', 'BatchRequestError']
\ No newline at end of file
@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from .. import fastjson
+
+
+# Batch任务进入这些状态后不会再变化
+_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchRequestError(Exception):
+    """Batch任务失败或某个请求没有返回有效结果"""
+
+
+class BatchDispatcher:
+    """
+    把可以延迟的对话请求攒成一批，通过OpenAI兼容的Batch API一次提交
+
+    调用方通过 submit() 提交请求并等待结果；第一个请求到达后等待
+    window_seconds 秒，期间到达的所有请求合并为一个Batch任务。
+    endpoint 是 chat/completions 接口相对于服务器根路径的完整路径，如 /v1/chat/completions
+    """
+
+    def __init__(self, get_client: Callable[[], Awaitable[httpx.AsyncClient]],
+                 window_seconds: float = 30, poll_interval: float = 30,
+                 timeout: float = 3600, endpoint: str = "/v1/chat/completions"):
+        self._get_client = get_client
+        self.endpoint = endpoint
+        self.window_seconds = window_seconds
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._pending: List[Tuple[str, Dict[str, Any], asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._ids = itertools.count(1)
+        self.logger = logging.getLogger(__name__)
+
+    async def submit(self, payload: Dict[str, Any]) -> str:
+        """提交一个 chat/completions 请求体，返回模型生成的内容"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((f"request-{next(self._ids)}", payload, future))
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+
+        return await future
+
+    async def _flush_after_window(self) -> None:
+        await asyncio.sleep(self.window_seconds)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+
+        try:
+            results = await asyncio.wait_for(self._run_batch(batch), timeout=self.timeout)
+        except Exception as e:
+            self.logger.error("Batch of %d requests failed: %s", len(batch), e)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(BatchRequestError(str(e)))
+            return
+
+        for custom_id, _, future in batch:
+            if future.done():
+                continue
+            result = results.get(custom_id)
+            if isinstance(result, str):
+                future.set_result(result)
+            else:
+                future.set_exception(BatchRequestError(f"{custom_id}: {result or '缺少返回结果'}"))
+
+    async def _run_batch(self, batch: List[Tuple[str, Dict[str, Any], asyncio.Future]]) -> Dict[str, Any]:
+        client = await self._get_client()
+
+        lines = [
+            fastjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": self.endpoint,
+                "body": payload
+            })
+            for custom_id, payload, _ in batch
+        ]
+
+        upload = await client.post(
+            "/files",
+            data={"purpose": "batch"},
+            files={"file": ("batch.jsonl", b"\n".join(lines), "application/jsonl")}
+        )
+        upload.raise_for_status()
+
+        created = await client.post("/batches", json={
+            "input_file_id": upload.json()["id"],
+            "endpoint": self.endpoint,
+            "completion_window": "24h"
+        })
+        created.raise_for_status()
+        batch_info = created.json()
+        self.logger.info("Submitted batch %s with %d requests", batch_info.get('id'), len(batch))
+
+        while batch_info.get("status") not in _FINAL_STATUSES:
+            await asyncio.sleep(self.poll_interval)
+            response = await client.get(f"/batches/{batch_info['id']}")
+            response.raise_for_status()
+            batch_info = response.json()
+
+        if batch_info["status"] != "completed" or not batch_info.get("output_file_id"):
+            raise BatchRequestError(f"Batch {batch_info.get('id')} ended with status {batch_info['status']}")
+
+        output = await client.get(f"/files/{batch_info['output_file_id']}/content")
+        output.raise_for_status()
+
+        results = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = fastjson.loads(line)
+            response = item.get("response") or {}
+            body = response.get("body") or {}
+            choices = body.get("choices")
+
+            if response.get("status_code") == 200 and choices and "message" in choices[0]:
+                results[item["custom_id"]] = choices[0]["message"]["content"]
+            else:
+                results[item["custom_id"]] = item.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+
+        return results
+
+
+__all__ = ['BatchDispatcher', 'BatchRequestError']
@@ -1,29 +1,195 @@
+import asyncio
+import hashlib
 import json
-import requests
-from typing import List, Dict, Any, Optional
+import logging
+import os
+import time
+import httpx
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlsplit
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
 from datetime import datetime
 
+from .. import fastjson
 from ..config import config
+from ..storage import get_message_time
+from .batch import BatchDispatcher
+
+
+# 流式输出时推送中间结果的最小间隔（秒），避免频繁编辑Telegram消息
+_STREAM_UPDATE_INTERVAL = 2.0
+
+_SYSTEM_PROMPT_TEMPLATE = """你是一个专业的群聊分析助手。请根据提供的群组聊天记录，生成一份{subject}。
+
+重要规则：只输出总结内容，不要添加任何开场白、解释或其他无关文字。不要使用转义字符。
+
+输出格式要求：
+热聊话题
+
+1. [话题标题]
+   - 时间：[{time_label}，如：14:30-16:45]
+   - 群成员：[参与该话题讨论的主要成员]
+   - 总结：[详细描述该话题的讨论过程、重要观点和结论，合理长度]
+   - 高热发言：[引用或转述该话题中最有代表性的观点或有趣言论]
+
+格式要求：
+- 话题标题要简洁且能概括讨论核心内容
+- 时间范围要准确反映讨论的起止时间
+- 群成员列出该话题的主要参与者，3-5人最佳
+- 总结部分要详细但不冗长
+- 高热发言要生动有趣，体现讨论的热点
+- 按话题重要性和热度排序，最重要的放在前面
+- 话题数量根据实际讨论情况调整，通常3-8个
+- 如果消息很多，请优先关注最热门的话题和最重要的讨论
+
+请直接按格式输出总结内容，不要使用任何转义字符："""
+
+# 提示词在模块加载时生成一次，时段总结只需填入时段名称
+_SUMMARY_SYSTEM_PROMPT = _SYSTEM_PROMPT_TEMPLATE.format(
+    subject="结构化的分话题总结",
+    time_label="时间范围"
+)
+_PERIOD_SYSTEM_PROMPT_TEMPLATE = _SYSTEM_PROMPT_TEMPLATE.format(
+    subject="关于{period_name}时段的结构化分话题总结",
+    time_label="具体时间范围"
+)
 
 
 class AISummary:
     def __init__(self):
         self.api_base = config.api_base.rstrip('/')
+        self.logger = logging.getLogger(__name__)
         self.api_key = config.api_key
         self.model = config.model
         self.max_tokens = config.get("ai.max_tokens", 128000)
         self.temperature = config.get("ai.temperature", 0.7)
-
-    def _make_api_request(self, messages: List[Dict[str, str]],
-                         max_tokens: Optional[int] = None) -> Optional[str]:
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.cache_enabled = config.get("ai.cache_enabled", True)
+        self.cache_ttl = config.get("ai.cache_ttl_seconds", 86400)
+        self._cache_path = Path(config.data_dir) / "ai_cache.json"
+        self._cache: Optional[Dict[str, Dict[str, Any]]] = None
+        # 后台写入缓存文件的任务，写入期间有新条目时由同一任务继续写入
+        self._cache_save_task: Optional[asyncio.Task] = None
+        self._cache_dirty = False
+        self.batch_enabled = config.get("ai.batch_enabled", False)
+        self._batch_dispatcher: Optional[BatchDispatcher] = None
+        self._batch_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _cache_key(self, payload: Dict[str, Any]) -> str:
+        """根据模型、生成参数和完整的对话内容计算缓存键"""
+        raw = fastjson.dumps(payload, sort_keys=True)
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    async def _load_cache(self) -> Dict[str, Dict[str, Any]]:
+        """首次使用时在线程中读取缓存文件，不阻塞事件循环"""
+        if self._cache is None:
+            cache = await asyncio.to_thread(self._read_cache_file)
+            # 等待读取期间其他请求可能已经加载过
+            if self._cache is None:
+                self._cache = cache
+        return self._cache
+
+    def _read_cache_file(self) -> Dict[str, Dict[str, Any]]:
+        if not self._cache_path.exists():
+            return {}
+        try:
+            with open(self._cache_path, 'rb') as f:
+                return fastjson.loads(f.read())
+        except (json.JSONDecodeError, IOError) as e:
+            self.logger.warning("Error loading AI cache: %s", e)
+            return {}
+
+    async def _get_cached(self, key: str) -> Optional[str]:
+        entry = (await self._load_cache()).get(key)
+        if entry and entry.get("expires_at", 0) > time.time():
+            return entry.get("content")
+        return None
+
+    async def _set_cached(self, key: str, content: str) -> None:
+        cache = await self._load_cache()
+        now = time.time()
+        # 写入时顺便清理过期条目，避免缓存文件无限增长
+        for expired_key in [k for k, v in cache.items() if v.get("expires_at", 0) <= now]:
+            del cache[expired_key]
+        cache[key] = {"content": content, "expires_at": now + self.cache_ttl}
+
+        # 文件在后台线程中写入，同一时间只有一个写入任务，连续的多个新条目合并为一次写入
+        self._cache_dirty = True
+        if self._cache_save_task is None or self._cache_save_task.done():
+            self._cache_save_task = asyncio.create_task(self._save_cache())
+
+    async def _save_cache(self) -> None:
+        while self._cache_dirty:
+            self._cache_dirty = False
+            # 浅拷贝后在线程中序列化，写入期间事件循环中继续修改缓存也不受影响
+            await asyncio.to_thread(self._write_cache_file, dict(self._cache))
+
+    def _write_cache_file(self, cache: Dict[str, Dict[str, Any]]) -> None:
+        """先写临时文件再替换，写入中断时不会损坏已有的缓存文件"""
+        tmp_path = self._cache_path.with_suffix('.tmp')
+        try:
+            self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(fastjson.dumps(cache))
+            os.replace(tmp_path, self._cache_path)
+        except OSError as e:
+            self.logger.warning("Error saving AI cache: %s", e)
+
+    async def _ensure_client(self) -> httpx.AsyncClient:
+        """按需创建HTTP客户端，客户端绑定在创建它的事件循环上"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            # 机器人和调度器共用一个事件循环；同一实例被多次 asyncio.run() 调用时（如测试脚本）
+            # 之前的循环已关闭，其中创建的连接不能复用，需要重新创建客户端
+            # 所有请求共用一个连接池，复用keep-alive连接，避免每次请求重新握手
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+                timeout=3600  # 增加超时时间
+            )
+            self._client_loop = loop
+        return self._client
+
+    def _get_batch_dispatcher(self) -> BatchDispatcher:
+        """按事件循环创建Batch调度器，同一循环内的可延迟请求合并提交"""
+        loop = asyncio.get_running_loop()
+        if self._batch_dispatcher is None or self._batch_loop is not loop:
+            self._batch_dispatcher = BatchDispatcher(
+                self._ensure_client,
+                window_seconds=config.get("ai.batch_window_seconds", 30),
+                poll_interval=config.get("ai.batch_poll_interval_seconds", 30),
+                timeout=config.get("ai.batch_timeout_seconds", 3600),
+                # Batch任务中的接口路径包含API地址自带的前缀（如 /v1），不能写死
+                endpoint=urlsplit(self.api_base).path.rstrip('/') + "/chat/completions"
+            )
+            self._batch_loop = loop
+        return self._batch_dispatcher
+
+    async def close(self) -> None:
+        # 等待尚未完成的缓存写入
+        if self._cache_save_task is not None and not self._cache_save_task.done():
+            await self._cache_save_task
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
+
+    async def _make_api_request(self, messages: List[Dict[str, str]],
+                                max_tokens: Optional[int] = None,
+                                use_cache: bool = True,
+                                deferrable: bool = False,
+                                on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """
+        调用 chat/completions 接口
+
+        on_partial 不为空时以流式方式请求，生成过程中定期把已生成的内容传给回调
+        """
         if not self.api_key:
             return "错误：未配置API密钥，请在config.json中设置ai.api_key"
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
         payload = {
             "model": self.model,
             "messages": messages,
@@ -31,43 +197,68 @@ class AISummary:
             "temperature": self.temperature
         }
 
+        use_cache = use_cache and self.cache_enabled
+        cache_key = self._cache_key(payload) if use_cache else None
+        if cache_key:
+            cached = await self._get_cached(cache_key)
+            if cached is not None:
+                self.logger.debug("AI cache hit, length: %d", len(cached))
+                return cached
+
+        # 定时任务不要求即时返回，开启后通过Batch API提交，失败时退回普通请求
+        if deferrable and self.batch_enabled:
+            try:
+                content = await self._get_batch_dispatcher().submit(payload)
+                if cache_key and content:
+                    await self._set_cached(cache_key, content)
+                return content
+            except Exception as e:
+                self.logger.warning("Batch request failed, falling back to direct request: %s", e)
+
         try:
-            print(f"Making API request to: {self.api_base}/chat/completions")
-            print(f"Model: {self.model}, Max tokens: {max_tokens or self.max_tokens}")
-            print(f"Messages count: {len(messages)}")
-
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=3600  # 增加超时时间
+            self.logger.debug("Making API request to: %s/chat/completions", self.api_base)
+            self.logger.debug("Model: %s, Max tokens: %s, Messages count: %d",
+                              self.model, max_tokens or self.max_tokens, len(messages))
+
+            client = await self._ensure_client()
+
+            if on_partial is not None:
+                content, error = await self._stream_completion(client, payload, on_partial)
+                if error:
+                    return error
+                self.logger.debug("Successfully got streamed response, length: %d", len(content))
+                if cache_key and content:
+                    await self._set_cached(cache_key, content)
+                return content
+
+            response = await client.post(
+                "/chat/completions",
+                content=fastjson.dumps(payload),
+                headers={"Content-Type": "application/json"}
             )
 
-            print(f"Response status: {response.status_code}")
+            self.logger.debug("Response status: %d", response.status_code)
 
             if response.status_code != 200:
-                print(f"Response body: {response.text}")
+                self.logger.warning("API request failed: HTTP %d", response.status_code)
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Response body: %s", response.text)
                 return f"API请求失败: HTTP {response.status_code} - {response.text[:200]}"
 
-            result = response.json()
-
-            if "choices" not in result or not result["choices"]:
-                print(f"Invalid API response: {result}")
-                return "API响应格式错误：缺少choices字段"
+            content, error = self._parse_completion(fastjson.loads(response.content))
+            if error:
+                return error
 
-            if "message" not in result["choices"][0]:
-                print(f"Invalid choice format: {result['choices'][0]}")
-                return "API响应格式错误：缺少message字段"
-
-            content = result["choices"][0]["message"]["content"]
-            print(f"Successfully got response, length: {len(content)}")
+            self.logger.debug("Successfully got response, length: %d", len(content))
+            if cache_key and content:
+                await self._set_cached(cache_key, content)
             return content
 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             return "API请求超时：请检查网络连接或稍后重试"
-        except requests.exceptions.ConnectionError as e:
+        except httpx.ConnectError as e:
             return f"网络连接错误: {str(e)}"
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             return f"API请求失败: {str(e)}"
         except json.JSONDecodeError as e:
             return f"JSON解析失败: {str(e)}"
@@ -76,132 +267,140 @@ class AISummary:
         except Exception as e:
             return f"未知错误: {str(e)}"
 
-    def format_messages_for_summary(self, messages: List[Dict[str, Any]]) -> str:
-        formatted_msgs = []
-        for msg in messages:
-            timestamp = msg.get('timestamp', '')
-            user = msg.get('user', 'Unknown')
-            text = msg.get('text', '')
+    def _parse_completion(self, result: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        """从非流式的 chat/completions 响应中取出内容，返回 (内容, 错误信息)"""
+        if "choices" not in result or not result["choices"]:
+            self.logger.warning("Invalid API response: %s", result)
+            return None, "API响应格式错误：缺少choices字段"
+
+        if "message" not in result["choices"][0]:
+            self.logger.warning("Invalid choice format: %s", result['choices'][0])
+            return None, "API响应格式错误：缺少message字段"
+
+        return result["choices"][0]["message"]["content"], None
+
+    async def _stream_completion(self, client: httpx.AsyncClient, payload: Dict[str, Any],
+                                 on_partial: Callable[[str], Awaitable[None]]) -> Tuple[str, Optional[str]]:
+        """以SSE流式方式请求，返回 (完整内容, 错误信息)"""
+        parts = []
+        # 还没有收到SSE事件时保留其他行，部分兼容接口会忽略 stream 参数直接返回普通JSON
+        plain_lines = []
+        seen_event = False
+        last_update = time.monotonic()
+
+        async with client.stream(
+            "POST",
+            "/chat/completions",
+            content=fastjson.dumps({**payload, "stream": True}),
+            headers={"Content-Type": "application/json"}
+        ) as response:
+            self.logger.debug("Response status: %d", response.status_code)
 
-            if text:
-                try:
-                    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    time_str = dt.strftime("%H:%M")
-                    formatted_msgs.append(f"[{time_str}] {user}: {text}")
-                except:
-                    formatted_msgs.append(f"{user}: {text}")
+            if response.status_code != 200:
+                body = (await response.aread()).decode('utf-8', errors='replace')
+                self.logger.warning("API request failed: HTTP %d", response.status_code)
+                self.logger.debug("Response body: %s", body)
+                return "", f"API请求失败: HTTP {response.status_code} - {body[:200]}"
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    if not seen_event:
+                        plain_lines.append(line)
+                    continue
+                seen_event = True
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
 
-        return "\n".join(formatted_msgs)
+                try:
+                    chunk = fastjson.loads(data)
+                except json.JSONDecodeError as e:
+                    # 单个损坏的事件跳过即可，不影响其余内容
+                    self.logger.warning("Skipping malformed stream chunk: %s", e)
+                    continue
+
+                choices = (chunk.get("choices") if isinstance(chunk, dict) else None) or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if not delta:
+                    continue
+
+                parts.append(delta)
+                now = time.monotonic()
+                if now - last_update >= _STREAM_UPDATE_INTERVAL:
+                    last_update = now
+                    try:
+                        await on_partial("".join(parts))
+                    except Exception as e:
+                        # 中间结果推送失败不影响最终结果
+                        self.logger.debug("Partial update callback failed: %s", e)
+
+        if not seen_event:
+            self.logger.debug("Stream response contained no SSE events, parsing as a regular completion")
+            try:
+                content, error = self._parse_completion(fastjson.loads("\n".join(plain_lines)))
+            except (json.JSONDecodeError, AttributeError, TypeError, KeyError, IndexError) as e:
+                self.logger.warning("Invalid stream response: %s", e)
+                return "", f"API响应解析失败: {str(e)}"
+            return content or "", error
+
+        return "".join(parts), None
 
-    def generate_summary(self, messages: List[Dict[str, Any]],
-                        summary_type: str = "daily") -> Optional[str]:
+    def format_messages_for_summary(self, messages: List[Dict[str, Any]]) -> str:
+        # 时间在分时段时已经解析并缓存在消息上，这里只做一次拼接
+        return "\n".join(
+            self._format_message_line(msg, text)
+            for msg in messages
+            if (text := msg.get('text', ''))
+        )
+
+    @staticmethod
+    def _format_message_line(msg: Dict[str, Any], text: str) -> str:
+        user = msg.get('user', 'Unknown')
+        dt = get_message_time(msg)
+        if dt is None:
+            return f"{user}: {text}"
+        return f"[{dt:%H:%M}] {user}: {text}"
+
+    async def generate_summary(self, messages: List[Dict[str, Any]],
+                               summary_type: str = "daily",
+                               on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
         if not messages:
             return "没有消息可以总结"
 
         formatted_messages = self.format_messages_for_summary(messages)
 
-        if summary_type == "daily":
-            system_prompt = """你是一个专业的群聊分析助手。请根据提供的群组聊天记录，生成一份结构化的分话题总结。
-
-重要规则：只输出总结内容，不要添加任何开场白、解释或其他无关文字。不要使用转义字符。
-
-输出格式要求：
-热聊话题
-
-1. [话题标题]
-   - 时间：[时间范围，如：14:30-16:45]
-   - 群成员：[参与该话题讨论的主要成员]
-   - 总结：[详细描述该话题的讨论过程、重要观点和结论，合理长度]
-   - 高热发言：[引用或转述该话题中最有代表性的观点或有趣言论]
-
-格式要求：
-- 话题标题要简洁且能概括讨论核心内容
-- 时间范围要准确反映讨论的起止时间
-- 群成员列出该话题的主要参与者，3-5人最佳
-- 总结部分要详细但不冗长
-- 高热发言要生动有趣，体现讨论的热点
-- 按话题重要性和热度排序，最重要的放在前面
-- 话题数量根据实际讨论情况调整，通常3-8个
-- 如果消息很多，请优先关注最热门的话题和最重要的讨论
-
-请直接按格式输出总结内容，不要使用任何转义字符："""
-        else:
-            system_prompt = """你是一个专业的群聊分析助手。请根据提供的群组聊天记录，生成一份结构化的分话题总结。
-
-重要规则：只输出总结内容，不要添加任何开场白、解释或其他无关文字。不要使用转义字符。
-
-输出格式要求：
-热聊话题
-
-1. [话题标题]
-   - 时间：[时间范围，如：14:30-16:45]
-   - 群成员：[参与该话题讨论的主要成员]
-   - 总结：[详细描述该话题的讨论过程、重要观点和结论，合理长度]
-   - 高热发言：[引用或转述该话题中最有代表性的观点或有趣言论]
-
-格式要求：
-- 话题标题要简洁且能概括讨论核心内容
-- 时间范围要准确反映讨论的起止时间
-- 群成员列出该话题的主要参与者，3-5人最佳
-- 总结部分要详细但不冗长
-- 高热发言要生动有趣，体现讨论的热点
-- 按话题重要性和热度排序，最重要的放在前面
-- 话题数量根据实际讨论情况调整，通常3-8个
-- 如果消息很多，请优先关注最热门的话题和最重要的讨论
-
-请直接按格式输出总结内容，不要使用任何转义字符："""
+        # 每日总结与手动总结使用同一份提示词
+        system_prompt = _SUMMARY_SYSTEM_PROMPT
 
         api_messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"以下是群组消息记录：\n\n{formatted_messages}"}
         ]
 
-        return self._make_api_request(api_messages)
+        return await self._make_api_request(api_messages, on_partial=on_partial)
 
-    def generate_period_summary(self, messages: List[Dict[str, Any]], period_name: str) -> Optional[str]:
-        """生成特定时段的总结"""
+    async def generate_period_summary(self, messages: List[Dict[str, Any]], period_name: str,
+                                      deferrable: bool = False) -> Optional[str]:
+        """生成特定时段的总结，deferrable=True 表示允许通过Batch API延迟处理"""
         if not messages:
             return "没有消息可以总结"
 
         try:
             formatted_messages = self.format_messages_for_summary(messages)
 
-            system_prompt = f"""你是一个专业的群聊分析助手。请根据提供的群组聊天记录，生成一份关于{period_name}时段的结构化分话题总结。
-
-重要规则：只输出总结内容，不要添加任何开场白、解释或其他无关文字。不要使用转义字符。
-
-输出格式要求：
-热聊话题
-
-1. [话题标题]
-   - 时间：[具体时间范围，如：14:30-16:45]
-   - 群成员：[参与该话题讨论的主要成员]
-   - 总结：[详细描述该话题的讨论过程、重要观点和结论，合理长度]
-   - 高热发言：[引用或转述该话题中最有代表性的观点或有趣言论]
-
-格式要求：
-- 话题标题要简洁且能概括讨论核心内容
-- 时间范围要准确反映讨论的起止时间
-- 群成员列出该话题的主要参与者，3-5人最佳
-- 总结部分要详细但不冗长
-- 高热发言要生动有趣，体现讨论的热点
-- 按话题重要性和热度排序，最重要的放在前面
-- 话题数量根据实际讨论情况调整，通常3-8个
-- 如果消息很多，请优先关注最热门的话题和最重要的讨论
-
-请直接按格式输出总结内容，不要使用任何转义字符："""
+            system_prompt = _PERIOD_SYSTEM_PROMPT_TEMPLATE.format(period_name=period_name)
 
             api_messages = [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"以下是{period_name}时段的群组消息记录：\n\n{formatted_messages}"}
             ]
 
-            return self._make_api_request(api_messages)
+            return await self._make_api_request(api_messages, deferrable=deferrable)
         except Exception as e:
             return f"错误：生成{period_name}时段总结时发生异常 - {str(e)}"
 
-    def generate_daily_summary(self, chat_id: int, messages: List[Dict[str, Any]]) -> Optional[str]:
-        summary = self.generate_summary(messages, "daily")
+    async def generate_daily_summary(self, chat_id: int, messages: List[Dict[str, Any]]) -> Optional[str]:
+        summary = await self.generate_summary(messages, "daily")
 
         if summary and not summary.startswith("错误") and not summary.startswith("没有消息"):
             date_str = datetime.now().strftime("%Y-%m-%d")
@@ -209,31 +408,41 @@ class AISummary:
             header = f"📊 **群组每日总结** ({date_str})\n"
             header += f"📝 消息总数: {len(messages)} 条\n"
 
-            user_counts = {}
-            for msg in messages:
-                user = msg.get('user', 'Unknown')
-                user_counts[user] = user_counts.get(user, 0) + 1
+            user_counts = Counter(msg.get('user', 'Unknown') for msg in messages)
 
             if user_counts:
-                top_users = sorted(user_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+                top_users = user_counts.most_common(5)
                 header += f"👥 活跃用户: {', '.join([f'{user}({count})' for user, count in top_users])}\n\n"
 
             return header + summary
 
         return summary
 
-    def generate_manual_summary(self, chat_id: int, messages: List[Dict[str, Any]],
-                              hours: int = 24) -> Optional[str]:
-        summary = self.generate_summary(messages, "manual")
+    async def generate_manual_summary(self, chat_id: int, messages: List[Dict[str, Any]],
+                                      hours: int = 24,
+                                      on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        summary = await self.generate_summary(messages, "manual", on_partial=on_partial)
         return summary
 
-    def test_connection(self) -> bool:
+    async def test_connection(self) -> bool:
+        # 优先用轻量的 /models 接口检查连通性，不消耗模型推理
+        try:
+            client = await self._ensure_client()
+            response = await client.get("/models", timeout=5)
+            if response.status_code == 200:
+                return True
+            if response.status_code not in (404, 405):
+                return False
+        except httpx.HTTPError:
+            pass
+
+        # 接口不支持 /models 时退回到一次简短的对话请求
         test_messages = [
             {"role": "system", "content": "你是一个测试助手。"},
             {"role": "user", "content": "请回复'连接成功'"}
         ]
 
-        response = self._make_api_request(test_messages, max_tokens=50)
+        response = await self._make_api_request(test_messages, max_tokens=50, use_cache=False)
         return response and "连接成功" in response
 
 
@@ -1,26 +1,291 @@
 import asyncio
+import importlib.util
+import json
 import logging
-from datetime import datetime, date
-from typing import Optional, List, Dict, Any
+import operator
+import os
+import re
+import signal
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from datetime import datetime, date, timedelta
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
 
 from telegram import Update, Bot
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 
 from ..config import config
-from ..storage import MessageStorage, get_local_time_with_offset, get_local_date_with_offset
+from ..storage import (
+    MessageStorage,
+    get_local_time_with_offset,
+    get_local_date_with_offset,
+    get_message_time
+)
 from ..ai import AISummary
 from ..scheduler import DailySummaryScheduler
+from ..ratelimit import AsyncRateLimiter
+
+
+# 每日总结按时段分批生成：(名称, 开始时间, 结束时间)
+_TIME_PERIODS = (
+    ("深夜", "00:00", "06:00"),
+    ("早晨", "06:00", "12:00"),
+    ("下午", "12:00", "18:00"),
+    ("晚上", "18:00", "23:59"),
+)
+
+
+def _parse_minute_of_day(hhmm: str) -> int:
+    hour, minute = map(int, hhmm.split(':'))
+    return hour * 60 + minute
+
+
+def _build_period_minute_table(time_periods) -> Tuple[Optional[int], ...]:
+    """
+    计算一天中每分钟（0-1439）所属时段的下标，不属于任何时段的分钟为None
+
+    与按时间范围过滤的规则相同：开始不晚于结束时包含两端（如 18:00-23:59），
+    跨日时段（如 22:00-06:00）包含开始、不包含结束；
+    边界分钟同时属于相邻两个时段时归入后面的时段
+    """
+    table: List[Optional[int]] = [None] * 1440
+    for index, (_, start, end) in enumerate(time_periods):
+        start_minute = _parse_minute_of_day(start)
+        end_minute = _parse_minute_of_day(end)
+        if start_minute <= end_minute:
+            minutes = range(start_minute, end_minute + 1)
+        else:
+            minutes = chain(range(start_minute, 1440), range(0, end_minute))
+        for minute in minutes:
+            table[minute] = index
+    return tuple(table)
+
+
+# 默认时段的分钟->时段下标表，模块加载时计算一次
+_PERIOD_BY_MINUTE = _build_period_minute_table(_TIME_PERIODS)
+
+# 取消息发送者，用于 Counter 统计用户活跃度
+_get_message_user = operator.methodcaller('get', 'user', 'Unknown')
+
+# 安装了 h2（httpx[http2]）时与Telegram使用HTTP/2连接
+_TELEGRAM_HTTP_VERSION = "2" if importlib.util.find_spec("h2") else "1.1"
+
+# remove_all_markdown 使用的正则：所有标记合并为一个正则，一次遍历完成替换
+_MD_STRIP_RE = re.compile(
+    r'(?P<header>^#+[ \t]*)'              # 标题标记 (# Header)
+    r'|(?P<list>^[ \t]*[*-][ \t]+)'       # 列表标记 (* item 或 - item)
+    r'|\[(?P<link>[^\]]+)\]\([^)]+\)'      # 链接 [text](url)
+    r'|(?P<codeblock>```[\s\S]*?```)'      # 代码块
+    r'|\*\*(?P<bold>.*?)\*\*'               # 粗体
+    r'|`(?P<code>.*?)`'                    # 行内代码
+    r'|\*(?P<italic>.*?)\*'                 # 斜体
+    r'|~~(?P<strike>.*?)~~'                # 删除线
+    r'|__(?P<under>.*?)__',                # 下划线
+    re.MULTILINE
+)
+# 整体删除的标记，其余标记保留其中的文字
+_MD_DROPPED_GROUPS = frozenset(('header', 'list', 'codeblock'))
+# 以上标记都会用到的字符，文本中一个都没有时无需执行正则替换
+_MD_MARKUP_CHARS = '*`~_[#-'
+
+
+def _strip_markdown_match(match) -> str:
+    group = match.lastgroup
+    if group in _MD_DROPPED_GROUPS:
+        return ''
+    if group == 'code':
+        return match.group(group)
+    # 粗体等标记内部可能还嵌套其他标记
+    return _MD_STRIP_RE.sub(_strip_markdown_match, match.group(group))
+
+# 转换为 MarkdownV2 时使用：需要转义的字符（与 telegram.helpers.escape_markdown(version=2) 相同，
+# 这里预编译一次），以及AI常用的代码块/行内代码/粗体/斜体片段
+_MDV2_SPECIAL_RE = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+_MDV2_CODE_SPECIAL_RE = re.compile(r'([`\\])')
+_MD_SPAN_RE = re.compile(
+    r'```(?:[^\n`]*\n)?([\s\S]*?)```'       # 代码块
+    r'|`([^`\n]+)`'                         # 行内代码
+    r'|\*\*(.+?)\*\*'                        # 粗体
+    r'|(?<!\*)\*(?![\s*])([^*\n]+?)\*(?!\*)'  # 斜体
+)
+
+
+def _escape_markdown_v2(text: str) -> str:
+    return _MDV2_SPECIAL_RE.sub(r'\\\1', text)
+
+
+def _escape_markdown_v2_code(text: str) -> str:
+    return _MDV2_CODE_SPECIAL_RE.sub(r'\\\1', text)
+
+
+def _to_markdown_v2(text: str) -> str:
+    """
+    把AI输出的常规Markdown一次性转换为Telegram MarkdownV2
+
+    识别出的代码块、行内代码、粗体和斜体转换为对应的V2标记，
+    其余文本全部转义，未配对的标记会作为普通字符显示而不会导致解析失败
+    """
+    parts = []
+    pos = 0
+    for match in _MD_SPAN_RE.finditer(text):
+        parts.append(_escape_markdown_v2(text[pos:match.start()]))
+        pre, code, bold, italic = match.groups()
+        if pre is not None:
+            parts.append("```\n" + _escape_markdown_v2_code(pre) + "```")
+        elif code is not None:
+            parts.append("`" + _escape_markdown_v2_code(code) + "`")
+        elif bold is not None:
+            parts.append("*" + _escape_markdown_v2(bold) + "*")
+        else:
+            parts.append("_" + _escape_markdown_v2(italic) + "_")
+        pos = match.end()
+    parts.append(_escape_markdown_v2(text[pos:]))
+    return "".join(parts)
+
+
+# 被Telegram限流时 safe_send_message 最多尝试发送的次数
+_MAX_SEND_ATTEMPTS = 3
+
+# 每日总结报告中最多保留的错误条数
+_MAX_REPORTED_ERRORS = 20
+
+# 单条消息的切分长度，Telegram上限为4096字符；Markdown内容按转换为MarkdownV2之后的长度计算，
+# 转义会给每个 . - ( 等字符加上反斜杠，原文长度不能代表发送的长度
+_MESSAGE_CHUNK_LIMIT = 4000
+
+def _markdown_v2_length(text: str) -> int:
+    """Markdown文本转换为MarkdownV2后实际发送的长度"""
+    return len(_to_markdown_v2(text))
+
+
+# 存储读写线程池的线程数，多个群组的每日总结并发加载消息时共用
+_IO_THREADS = 8
+
+# handle_message 去重时记住的最近消息数量
+_SEEN_MESSAGES_LIMIT = 1000
+
+# /start 和 /help 的固定回复内容
+_WELCOME_TEXT = """
+🤖 Telegram群组总结机器人已启动！
+
+可用命令：
+/summary - 生成最近100条消息总结
+/dailysummary - 手动触发生成今日总结
+/stats - 查看今日统计
+/schedulerstatus - 查看调度器状态
+/help - 显示帮助信息
+
+机器人的功能：
+• 自动保存群组消息
+• 每日自动生成总结（配置文件中设置时间）
+• 支持手动总结最近消息
+• 支持手动触发每日总结
+• 可配置AI API地址和模型
+• 详细的任务执行报告
+
+⚠️重要使用说明：
+• 在群组中，命令可以直接使用
+• 在群组中，普通消息需要 @机器人用户名 才会触发
+• 在私聊中所有消息都可以直接触发，无需 @ 提及
+• 每日总结时间需在配置文件中设置
+• 所有时间都使用计算机默认时间
+"""
+
+_HELP_TEXT = """
+📋 **命令帮助**
+
+/start - 启动机器人
+/summary - 总结最近100条消息
+/dailysummary - 手动触发生成今日总结（按时段生成）
+/schedulerstatus - 查看调度器状态（显示下次执行时间、时区偏移、AI模型等）
+/stats - 显示今日群组统计信息
+/help - 显示此帮助信息
+
+**配置说明：**
+• 在config.json中设置机器人token
+• 配置允许的群组ID
+• 设置AI API地址和密钥
+• 自定义总结参数
+
+**功能特性：**
+• 每个群组消息独立存储
+• 每日自动生成总结（配置文件中设置时间）
+• 支持手动触发每日总结
+• 支持自定义API地址
+• 消息按日期分文件存储
+• 总结按时段分类生成（早晨、下午、晚上、深夜）
+• 详细的执行报告和错误通知
+• 调度器状态监控（显示时区、AI模型配置）
+
+**重要说明：**
+• 📌 **在群组中，命令可以直接使用，普通消息需要 @机器人用户名 才会触发**
+• 📌 **在私聊中所有消息都可以直接触发，无需 @ 提及**
+• 每日总结时间需在配置文件的 daily_summary_time 字段中设置
+• 所有时间都使用计算机默认时间
+• 格式示例：\"23:59\" 或 \"08:00\"
+• 每日总结会发送到所有允许的群组
+• 任务执行过程中会发送详细的进度通知
+• /summary 默认总结100条消息
+"""
+
+
+def _iter_text_chunks(text: str, limit: int):
+    """
+    按段落/换行边界切分长文本，逐块生成
+
+    优先在limit范围内最后一个空行处切分，其次是最后一个换行，
+    都没有时才按limit硬切
+    """
+    start = 0
+    length = len(text)
+    while length - start > limit:
+        end = start + limit
+        cut = text.rfind('\n\n', start, end)
+        if cut > start:
+            yield text[start:cut]
+            start = cut + 2
+            continue
+
+        cut = text.rfind('\n', start, end)
+        if cut > start:
+            yield text[start:cut]
+            start = cut + 1
+            continue
+
+        yield text[start:end]
+        start = end
+
+    if start < length:
+        yield text[start:]
 
 
 class TelegramBot:
     def __init__(self):
         self.bot_token = config.bot_token
-        self.allowed_chats = config.allowed_chats
+        # 允许的群组（配置中已是frozenset），每条消息只做一次哈希查找；未配置时为None表示不限制。
+        # 按配置的原始列表判断是否配置，ID全部无效时不会变成不限制
+        self.allowed_chats = config.allowed_chats if config.get("telegram.allowed_chats") else None
         self.storage = MessageStorage()
         self.ai_summary = AISummary()
         self.scheduler = DailySummaryScheduler(self)
         self.application = None
+        # 限制每日总结各时段并发请求AI接口的速率
+        self._ai_limiter = AsyncRateLimiter(config.ai_requests_per_second, 1)
+        # 每个群组的Telegram发送速率限制器
+        self._chat_limiters: Dict[int, AsyncRateLimiter] = {}
+        # 小写的 @机器人用户名，首次需要时从 context.bot 获取
+        self._bot_mention: Optional[str] = None
+        # 最近保存过的 (chat_id, message_id)，避免重复投递的更新被保存两次
+        self._seen_messages: "OrderedDict[Tuple[int, int], None]" = OrderedDict()
+        # 正在进行中的手动总结任务，同一群组的重复 /summary 共用一次生成
+        self._inflight_summaries: Dict[Tuple[int, int], asyncio.Task] = {}
+        # MarkdownV2转换后仍被Telegram拒绝、降级为纯文本发送的次数，正常情况下应保持为0
+        self.markdown_fallback_count = 0
 
         logging.basicConfig(
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -28,104 +293,117 @@ class TelegramBot:
         )
         self.logger = logging.getLogger(__name__)
 
-    async def safe_send_message(self, chat_id, text, update=None, parse_mode=None):
-        """安全发送消息，自动处理Markdown错误"""
+        # 持久化已处理的最新update_id，重启后不会重复处理之前的更新
+        self._offset_path = Path(config.data_dir) / "telegram_offset.json"
+        self._last_update_id = self._load_update_offset()
+        self._saved_update_id = self._last_update_id
+        # 延迟保存update_id的任务，有新的更新时才创建，1秒内的多个更新只写一次文件
+        self._offset_flush_task: Optional[asyncio.Task] = None
+        # start() 运行时的事件循环和停止事件，stop() 通过它唤醒主协程
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+    async def _send_text(self, chat_id, text, update=None, parse_mode=None):
+        """发送一条消息，有update时回复该消息"""
+        if update:
+            return await update.message.reply_text(text, parse_mode=parse_mode)
+        if self.application:
+            return await self.application.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        return None
+
+    def _load_update_offset(self) -> Optional[int]:
+        if not self._offset_path.exists():
+            return None
         try:
-            # 首先尝试发送（根据参数决定是否使用Markdown）
-            if update:
-                if parse_mode:
-                    return await update.message.reply_text(text, parse_mode=parse_mode)
-                else:
-                    return await update.message.reply_text(text)
-            else:
-                if parse_mode and self.application:
-                    return await self.application.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
-                elif self.application:
-                    return await self.application.bot.send_message(chat_id=chat_id, text=text)
-        except Exception as e:
-            self.logger.warning(f"Message send failed with parse_mode={parse_mode}, error: {e}")
+            with open(self._offset_path, 'r', encoding='utf-8') as f:
+                return int(json.load(f)["offset"])
+        except (ValueError, KeyError, TypeError, IOError) as e:
+            self.logger.warning(f"Error loading update offset: {e}")
+            return None
 
-            # 如果是Markdown解析错误，尝试清理后重新发送
-            if parse_mode == 'Markdown' or 'parse' in str(e).lower() or 'entity' in str(e).lower():
-                try:
-                    # 如果Markdown失败，尝试移除不完整的标记
-                    clean_text = self.fix_markdown_errors(text)
-                    if update:
-                        return await update.message.reply_text(clean_text, parse_mode=ParseMode.MARKDOWN)
-                    else:
-                        return await self.application.bot.send_message(chat_id=chat_id, text=clean_text, parse_mode=ParseMode.MARKDOWN)
-                except Exception as e2:
-                    self.logger.warning(f"Markdown still failed after cleanup, sending as plain text: {e2}")
-                    try:
-                        # 最后尝试作为纯文本发送
-                        plain_text = self.remove_all_markdown(text)
-                        if update:
-                            return await update.message.reply_text(plain_text)
-                        else:
-                            return await self.application.bot.send_message(chat_id=chat_id, text=plain_text)
-                    except Exception as e3:
-                        self.logger.error(f"Failed to send message even as plain text: {e3}")
-                        return None
-            else:
-                # 如果不是Markdown错误，尝试作为纯文本发送
-                try:
-                    if update:
-                        return await update.message.reply_text(text)
-                    else:
-                        return await self.application.bot.send_message(chat_id=chat_id, text=text)
-                except Exception as e2:
-                    self.logger.error(f"Failed to send message as plain text: {e2}")
-                    return None
+    def _save_update_offset(self) -> None:
+        """原子地写入最新的update_id，没有变化时不写入"""
+        last_update_id = self._last_update_id
+        if last_update_id is None or last_update_id == self._saved_update_id:
+            return
 
-    def fix_markdown_errors(self, text):
-        """修复常见的Markdown错误，如未闭合的标记"""
-        import re
+        tmp_path = self._offset_path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"offset": last_update_id}, f)
+            os.replace(tmp_path, self._offset_path)
+            self._saved_update_id = last_update_id
+        except OSError as e:
+            self.logger.warning(f"Error saving update offset: {e}")
+
+    async def track_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """在其他处理器处理完更新后记录其update_id"""
+        if self._last_update_id is None or update.update_id > self._last_update_id:
+            self._last_update_id = update.update_id
+            if self._offset_flush_task is None or self._offset_flush_task.done():
+                self._offset_flush_task = asyncio.create_task(self._flush_update_offset())
+
+    async def _flush_update_offset(self) -> None:
+        """等待1秒合并期间的更新，然后在线程中保存最新的update_id，保存期间又有新的更新时继续"""
+        while self._last_update_id != self._saved_update_id:
+            await asyncio.sleep(1)
+            await asyncio.to_thread(self._save_update_offset)
+
+    async def safe_send_message(self, chat_id, text, update=None, parse_mode=None, trusted=False):
+        """
+        安全发送消息
 
-        # 修复未闭合的粗体 **
-        # 统计 ** 的数量，如果是奇数，在最后添加一个 **
-        bold_count = len(re.findall(r'\*\*', text))
-        if bold_count % 2 != 0:
-            text += ' **'
+        Markdown内容会先转换为MarkdownV2再发送，通常一次就能成功；
+        只有Telegram仍然无法解析时才去掉标记以纯文本重发
+        trusted=True 用于机器人自己构造的固定格式文本，只发送一次，不做重试和降级，异常直接抛给调用方
+        """
+        if parse_mode == ParseMode.MARKDOWN:
+            send_text, send_mode = _to_markdown_v2(text), ParseMode.MARKDOWN_V2
+        else:
+            send_text, send_mode = text, parse_mode
 
-        # 修复未闭合的斜体 *
-        # 需要排除 ** 中的 *
-        single_stars = re.findall(r'(?<!\*)\*(?!\*)', text)  # 不匹配 ** 中的 *
-        if len(single_stars) % 2 != 0:
-            text += ' *'
+        if trusted:
+            return await self._send_text(chat_id, send_text, update, send_mode)
 
-        # 修复未闭合的行内代码 `
-        code_count = len(re.findall(r'(?<!`)`(?!`)', text))
-        if code_count % 2 != 0:
-            text += ' `'
+        for attempt in range(1, _MAX_SEND_ATTEMPTS + 1):
+            try:
+                return await self._send_text(chat_id, send_text, update, send_mode)
+            except RetryAfter as e:
+                # 触发Telegram限流，按服务器给出的时间等待后重试，多次仍被限流时放弃
+                if attempt == _MAX_SEND_ATTEMPTS:
+                    self.logger.error("Still rate limited by Telegram after %d attempts, giving up", attempt)
+                    return None
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.logger.warning("Rate limited by Telegram, retrying in %ss", retry_after)
+                await asyncio.sleep(retry_after)
+            except BadRequest as e:
+                if not send_mode:
+                    self.logger.error(f"Failed to send message as plain text: {e}")
+                    return None
+                # 冷路径：转换后的MarkdownV2理论上总能解析，走到这里说明转换规则有遗漏
+                self.markdown_fallback_count += 1
+                self.logger.warning(
+                    "Message send failed with parse_mode=%s, sending as plain text (fallback #%d): %s",
+                    send_mode, self.markdown_fallback_count, e
+                )
+                break
+            except Exception as e:
+                self.logger.error(f"Failed to send message: {e}")
+                return None
 
-        return text
+        try:
+            return await self._send_text(chat_id, self.remove_all_markdown(text), update)
+        except Exception as e:
+            self.logger.error(f"Failed to send message even as plain text: {e}")
+            return None
 
     def remove_all_markdown(self, text):
         """移除所有Markdown标记"""
-        import re
-
-        # 移除链接 [text](url)
-        text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
-
-        # 移除所有其他Markdown标记
-        for pattern, replacement in [
-            (r'\*\*(.*?)\*\*', r'\1'),  # 粗体
-            (r'\*(.*?)\*', r'\1'),      # 斜体
-            (r'`(.*?)`', r'\1'),        # 行内代码
-            (r'```[\s\S]*?```', ''),    # 代码块
-            (r'~~(.*?)~~', r'\1'),      # 删除线
-            (r'__(.*?)__', r'\1'),      # 下划线
-            (r'~~(.*?)~~', r'\1'),      # 删除线
-        ]:
-            text = re.sub(pattern, replacement, text, flags=re.MULTILINE)
-
-        # 移除标题标记 (# Header)
-        text = re.sub(r'^#+\s*(.*)$', r'\1', text, flags=re.MULTILINE)
-
-        # 移除列表标记 (* item 或 - item)
-        text = re.sub(r'^\s*[*-]\s+(.*)$', r'\1', text, flags=re.MULTILINE)
-
-        return text.strip()
+        if not any(c in text for c in _MD_MARKUP_CHARS):
+            return text.strip()
+        return _MD_STRIP_RE.sub(_strip_markdown_match, text).strip()
 
     async def delete_message_safely(self, chat_id: int, message_id: int) -> None:
         """安全删除消息，忽略权限错误"""
@@ -133,22 +411,38 @@ class TelegramBot:
             await self.application.bot.delete_message(chat_id=chat_id, message_id=message_id)
         except Exception as e:
             # 忽略删除失败的情况（如没有权限、消息已删除等）
-            self.logger.debug(f"Failed to delete message {message_id} in chat {chat_id}: {e}")
+            self.logger.debug("Failed to delete message %s in chat %s: %s", message_id, chat_id, e)
             pass
 
+    async def update_status_message(self, chat_id: int, message_id: int, text: str) -> None:
+        """把状态消息编辑为新的内容，编辑失败（如消息已被删除）时改为发送新消息"""
+        try:
+            await self.application.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            self.logger.debug("Failed to edit status message %s in chat %s: %s", message_id, chat_id, e)
+            await self.safe_send_message(chat_id, text)
+        except TelegramError as e:
+            # 状态消息只是进度提示，限流、超时或网络错误时跳过这次更新，不中断调用方的流程
+            self.logger.warning("Failed to update status message %s in chat %s: %s", message_id, chat_id, e)
+
     async def split_and_send(self, chat_id, text, update=None):
-        """分割长消息并发送"""
-        if len(text) > 4000:
-            chunks = [text[i:i+4000] for i in range(0, len(text), 4000)]
-            for i, chunk in enumerate(chunks):
+        """分割长消息并发送，在换行处切分，按群组限制发送速率"""
+        limiter = self._get_chat_limiter(chat_id)
+        for chunk in _iter_text_chunks(text, _MESSAGE_CHUNK_LIMIT):
+            async with limiter:
                 await self.safe_send_message(chat_id, chunk, update)
-                if i < len(chunks) - 1:
-                    await asyncio.sleep(1)  # 避免发送太快
-        else:
-            await self.safe_send_message(chat_id, text, update)
+
+    def _get_chat_limiter(self, chat_id: int) -> AsyncRateLimiter:
+        """每个群组单独限速（平均每秒1条，允许短时间连发3条），不同群组之间互不影响"""
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            limiter = self._chat_limiters[chat_id] = AsyncRateLimiter(3, 3)
+        return limiter
 
     def is_allowed_chat(self, chat_id: int) -> bool:
-        return not self.allowed_chats or chat_id in self.allowed_chats
+        return self.allowed_chats is None or chat_id in self.allowed_chats
 
     def extract_message_info(self, update: Update) -> Optional[dict]:
         if not update.message or not update.message.text:
@@ -170,7 +464,9 @@ class TelegramBot:
         return {
             "user": user_name,
             "text": message.text,
-            "chat_id": chat_id
+            "chat_id": chat_id,
+            # 消息的发送时间（UTC），重启后补收的消息也能记录在正确的时间
+            "date": message.date.replace(tzinfo=None) if message.date else None
         }
 
     def _should_respond(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -191,104 +487,47 @@ class TelegramBot:
 
         message_text = update.message.text if update.message and update.message.text else ""
 
-        # For group chats, check if it's a command
-        if message_text.startswith('/'):
+        # For group chats, check if it's a command (single-char prefix check, no lowercasing needed)
+        if message_text[:1] == '/':
             # Commands always work in group chats (no @ mention required)
             return True
 
         # For non-command messages in group chats, require @ mention
-        bot_username = context.bot.username if context.bot else None
-
-        # If we can't get bot username, be conservative and don't respond
-        if not bot_username:
-            self.logger.warning(f"Cannot determine bot username, not responding in group chat {chat.id}")
+        # Most group messages contain no '@' at all, skip them before any lowercasing
+        if '@' not in message_text:
             return False
 
-        # Check if message contains @bot_username mention
-        target_mention = f"@{bot_username}".lower()
-        text_lower = message_text.lower() if message_text else ""
+        # The lowercased mention is computed once and cached
+        target_mention = self._bot_mention
+        if target_mention is None:
+            bot_username = context.bot.username if context.bot else None
+
+            # If we can't get bot username, be conservative and don't respond
+            if not bot_username:
+                self.logger.warning(f"Cannot determine bot username, not responding in group chat {chat.id}")
+                return False
 
-        if target_mention in text_lower:
-            self.logger.debug(f"Found bot mention in message, responding")
+            target_mention = self._bot_mention = f"@{bot_username}".lower()
+
+        # Check if message contains @bot_username mention
+        if target_mention in message_text.lower():
+            self.logger.debug("Found bot mention in message, responding")
             return True
         else:
-            self.logger.debug(f"No bot mention found in group chat for non-command message, not responding")
+            self.logger.debug("No bot mention found in group chat %s for non-command message, not responding", chat.id)
             return False
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not self._should_respond(update, context):
             return
 
-        welcome_text = """
-🤖 Telegram群组总结机器人已启动！
-
-可用命令：
-/summary - 生成最近100条消息总结
-/dailysummary - 手动触发生成今日总结
-/stats - 查看今日统计
-/schedulerstatus - 查看调度器状态
-/help - 显示帮助信息
-
-机器人的功能：
-• 自动保存群组消息
-• 每日自动生成总结（配置文件中设置时间）
-• 支持手动总结最近消息
-• 支持手动触发每日总结
-• 可配置AI API地址和模型
-• 详细的任务执行报告
-
-⚠️重要使用说明：
-• 在群组中，命令可以直接使用
-• 在群组中，普通消息需要 @机器人用户名 才会触发
-• 在私聊中所有消息都可以直接触发，无需 @ 提及
-• 每日总结时间需在配置文件中设置
-• 所有时间都使用计算机默认时间
-        """
-
-        await update.message.reply_text(welcome_text)
+        await update.message.reply_text(_WELCOME_TEXT)
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not self._should_respond(update, context):
             return
 
-        help_text = """
-📋 **命令帮助**
-
-/start - 启动机器人
-/summary - 总结最近100条消息
-/dailysummary - 手动触发生成今日总结（按时段生成）
-/schedulerstatus - 查看调度器状态（显示下次执行时间、时区偏移、AI模型等）
-/stats - 显示今日群组统计信息
-/help - 显示此帮助信息
-
-**配置说明：**
-• 在config.json中设置机器人token
-• 配置允许的群组ID
-• 设置AI API地址和密钥
-• 自定义总结参数
-
-**功能特性：**
-• 每个群组消息独立存储
-• 每日自动生成总结（配置文件中设置时间）
-• 支持手动触发每日总结
-• 支持自定义API地址
-• 消息按日期分文件存储
-• 总结按时段分类生成（早晨、下午、晚上、深夜）
-• 详细的执行报告和错误通知
-• 调度器状态监控（显示时区、AI模型配置）
-
-**重要说明：**
-• 📌 **在群组中，命令可以直接使用，普通消息需要 @机器人用户名 才会触发**
-• 📌 **在私聊中所有消息都可以直接触发，无需 @ 提及**
-• 每日总结时间需在配置文件的 daily_summary_time 字段中设置
-• 所有时间都使用计算机默认时间
-• 格式示例：\"23:59\" 或 \"08:00\"
-• 每日总结会发送到所有允许的群组
-• 任务执行过程中会发送详细的进度通知
-• /summary 默认总结100条消息
-        """
-
-        await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text(_HELP_TEXT, parse_mode=ParseMode.MARKDOWN)
 
     async def summary_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not self._should_respond(update, context):
@@ -302,47 +541,64 @@ class TelegramBot:
 
         try:
             # 默认配置：只总结最近100条消息，不限制时间
-            message_count = 100
-
-            print(f"Looking for messages: count={message_count}")
-
-            # 加载消息
-            messages = self.storage.get_latest_messages(chat_id, message_count)
-            print(f"Found {len(messages)} total messages")
-
-            if not messages:
-                # 删除状态消息并发送无消息提示
-                await self.delete_message_safely(chat_id, status_message_id)
-                await update.message.reply_text("📭 没有找到可以总结的消息")
+            message_count = config.manual_summary_message_count
+
+            async def show_progress(partial_text):
+                # 流式生成过程中把状态消息更新为已生成的部分内容
+                preview = partial_text[:3800]
+                if len(partial_text) > 3800:
+                    preview += "..."
+                await self.application.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=status_message_id,
+                    text=f"{preview}\n\n⏳ 正在生成..."
+                )
+
+            on_partial = show_progress if config.get("ai.stream_enabled", True) else None
+
+            # 同一群组已有相同的总结在生成时直接等待其结果，不再重复调用AI
+            key = (chat_id, message_count)
+            task = self._inflight_summaries.get(key)
+            if task is None:
+                task = asyncio.create_task(self._run_manual_summary(key, on_partial))
+                self._inflight_summaries[key] = task
+            has_messages, summary = await asyncio.shield(task)
+
+            if not has_messages:
+                # 把状态消息改为无消息提示
+                await self.update_status_message(chat_id, status_message_id, "📭 没有找到可以总结的消息")
                 return
 
-            print(f"Found {len(messages)} messages")
-
-            if not messages:
-                # 删除状态消息并发送无消息提示
-                await self.delete_message_safely(chat_id, status_message_id)
-                await update.message.reply_text("📭 没有找到可以总结的消息")
-                return
-
-            print("Calling AI summary...")
-            summary = self.ai_summary.generate_manual_summary(chat_id, messages, 24)
-            print(f"Summary generated: {summary[:100] if summary else 'None'}...")
-
             if summary:
                 # 发送总结
                 await self.split_and_send(chat_id, summary, update)
                 # 删除状态消息
                 await self.delete_message_safely(chat_id, status_message_id)
             else:
-                # 删除状态消息并发送失败提示
-                await self.delete_message_safely(chat_id, status_message_id)
-                await update.message.reply_text("❌ 生成总结失败")
+                # 把状态消息改为失败提示
+                await self.update_status_message(chat_id, status_message_id, "❌ 生成总结失败")
 
         except Exception as e:
-            self.logger.error(f"Error in summary command: {e}")
-            # 删除状态消息并发送错误提示
-            await self.delete_message_safely(chat_id, status_message_id)
-            await update.message.reply_text(f"❌ 生成总结时出错: {str(e)}")
+            self.logger.error("Error in summary command: %s", e)
+            # 把状态消息改为错误提示
+            await self.update_status_message(chat_id, status_message_id, f"❌ 生成总结时出错: {str(e)}")
+
+    async def _run_manual_summary(self, key: Tuple[int, int], on_partial) -> Tuple[bool, Optional[str]]:
+        """加载消息并生成手动总结，返回 (是否有消息, 总结内容)"""
+        chat_id, message_count = key
+        try:
+            # 加载消息（文件读取放到线程中，不阻塞事件循环）
+            messages = await asyncio.to_thread(self.storage.get_messages_since, chat_id, None, message_count)
+            self.logger.debug("Found %d messages for chat %s", len(messages), chat_id)
+
+            if not messages:
+                return False, None
+
+            summary = await self.ai_summary.generate_manual_summary(chat_id, messages, 24, on_partial=on_partial)
+            self.logger.debug("Summary generated for chat %s, length: %d", chat_id, len(summary) if summary else 0)
+            return True, summary
+        finally:
+            self._inflight_summaries.pop(key, None)
 
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not self._should_respond(update, context):
@@ -351,8 +607,8 @@ class TelegramBot:
         chat_id = update.effective_chat.id
 
         try:
-            stats = self.storage.get_daily_stats(chat_id, get_local_date_with_offset())
-            recent_count = self.storage.get_message_count(chat_id, 24)
+            stats = await asyncio.to_thread(self.storage.get_daily_stats, chat_id, get_local_date_with_offset())
+            recent_count = await asyncio.to_thread(self.storage.get_message_count, chat_id, 24)
 
             stats_text = f"""
 📊 **今日群组统计** ({get_local_date_with_offset().strftime('%Y-%m-%d')})
@@ -363,9 +619,10 @@ class TelegramBot:
 """
 
             if stats['users']:
-                stats_text += "\n🏆 **活跃用户排行:**\n"
-                for i, (user, count) in enumerate(stats['users'][:10], 1):
-                    stats_text += f"{i}. {user}: {count} 条消息\n"
+                ranking = "".join(
+                    f"{i}. {user}: {count} 条消息\n" for i, (user, count) in enumerate(stats['users'][:10], 1)
+                )
+                stats_text = f"{stats_text}\n🏆 **活跃用户排行:**\n{ranking}"
 
             await update.message.reply_text(stats_text, parse_mode=ParseMode.MARKDOWN)
 
@@ -388,23 +645,20 @@ class TelegramBot:
             # 调用发送每日总结的方法，并获取结果报告
             result = await self.send_daily_summary(chat_id)
 
-            # 删除状态消息
-            await self.delete_message_safely(chat_id, status_message_id)
-
-            # 根据结果发送简短的反馈
+            # 根据结果把状态消息改为简短的反馈
             if result.get('status') == 'success':
-                await update.message.reply_text(f"✅ 每日总结任务完成!")
+                feedback = "✅ 每日总结任务完成!"
             elif result.get('status') == 'partial':
-                await update.message.reply_text(f"⚠️ 每日总结部分完成，有 {len(result.get('errors', []))} 个错误")
+                feedback = f"⚠️ 每日总结部分完成，有 {len(result.get('errors', []))} 个错误"
             elif result.get('status') == 'no_messages':
-                await update.message.reply_text(f"ℹ️ 今日没有消息记录")
+                feedback = "ℹ️ 今日没有消息记录"
             else:
-                await update.message.reply_text(f"❌ 生成总结时发生错误")
+                feedback = "❌ 生成总结时发生错误"
+            await self.update_status_message(chat_id, status_message_id, feedback)
 
         except Exception as e:
             self.logger.error(f"Error in daily_summary command: {e}")
-            await self.delete_message_safely(chat_id, status_message_id)
-            await update.message.reply_text(f"❌ 生成今日总结时出错: {str(e)}")
+            await self.update_status_message(chat_id, status_message_id, f"❌ 生成今日总结时出错: {str(e)}")
 
     async def scheduler_status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """查询调度器状态的命令"""
@@ -415,13 +669,11 @@ class TelegramBot:
 
         try:
             is_running = self.scheduler.running if self.scheduler else False
-            target_time = config.daily_summary_time if hasattr(config, 'daily_summary_time') else "未配置"
-            is_enabled = config.daily_summary_enabled if hasattr(config, 'daily_summary_enabled') else False
-            timezone_offset = config.timezone_offset_hours if hasattr(config, 'timezone_offset_hours') else 0
-            ai_model = config.model if hasattr(config, 'model') else "未配置"
-            api_base = config.api_base if hasattr(config, 'api_base') else "未配置"
-
-            from datetime import datetime, timedelta
+            target_time = getattr(config, 'daily_summary_time', "未配置")
+            is_enabled = getattr(config, 'daily_summary_enabled', False)
+            timezone_offset = getattr(config, 'timezone_offset_hours', 0)
+            ai_model = getattr(config, 'model', "未配置")
+            api_base = getattr(config, 'api_base', "未配置")
 
             # 计算下次执行时间
             next_time_str = "N/A"
@@ -476,10 +728,18 @@ class TelegramBot:
         if not message_info:
             return
 
-
+        # 跳过重复投递的消息
+        key = (message_info['chat_id'], update.message.message_id)
+        if key in self._seen_messages:
+            self.logger.debug("Skipping duplicate message %s", key)
+            return
+        self._seen_messages[key] = None
+        if len(self._seen_messages) > _SEEN_MESSAGES_LIMIT:
+            self._seen_messages.popitem(last=False)
 
         try:
-            self.storage.save_message(message_info['chat_id'], message_info)
+            # 磁盘写入放到线程池，避免阻塞事件循环
+            await asyncio.to_thread(self.storage.save_message, message_info['chat_id'], message_info)
 
         except Exception as e:
             self.logger.error(f"Error saving message: {e}")
@@ -496,8 +756,6 @@ class TelegramBot:
         }
         """
 
-        start_time = datetime.now()
-
         result = {
             'status': 'failed',
             'total_messages': 0,
@@ -506,115 +764,136 @@ class TelegramBot:
             'summary_sent': False
         }
 
+        def push_error(error_msg: str) -> None:
+            # 只保留有限条错误，AI接口完全不可用时错误列表也不会无限增长
+            if len(result['errors']) < _MAX_REPORTED_ERRORS:
+                result['errors'].append(error_msg)
+
         try:
             # 使用考虑偏移量的本地时间获取当天的所有消息
             local_now = get_local_time_with_offset()
             local_today = local_now.date()
 
-            messages = self.storage.load_messages(chat_id, local_today)
+            messages = await asyncio.to_thread(self.storage.load_messages, chat_id, local_today)
             self.logger.info(f"Loaded {len(messages)} messages for chat {chat_id} on {local_today}")
 
             if not messages:
                 # 发送无消息提示
                 date_str = local_today.strftime("%Y-%m-%d")
                 no_msg_summary = f"📊 **群组每日总结** ({date_str})\n\n📭 今日没有消息记录"
-                await self.safe_send_message(chat_id, no_msg_summary, parse_mode=ParseMode.MARKDOWN)
+                await self.safe_send_message(chat_id, no_msg_summary, parse_mode=ParseMode.MARKDOWN, trusted=True)
                 result['status'] = 'no_messages'
                 result['summary_sent'] = True
                 return result
 
             result['total_messages'] = len(messages)
 
-            # 按时间段分批总结（分为4个时段：深夜、晚上、下午、早晨）
-            time_periods = [
-                {"name": "深夜", "start": "00:00", "end": "06:00"},
-                {"name": "早晨", "start": "06:00", "end": "12:00"},
-                {"name": "下午", "start": "12:00", "end": "18:00"},
-                {"name": "晚上", "start": "18:00", "end": "23:59"}
-            ]
-
             period_summaries = []
             total_messages_processed = 0
-            error_messages = []
 
-            # 发送标题
+            # 标题和各时段总结、统计信息拼接在一起发送，不单独占用一条消息
             date_str = local_today.strftime("%Y-%m-%d")
             header = f"📊 **群组每日总结** ({date_str})"
-            await self.safe_send_message(chat_id, header, parse_mode=ParseMode.MARKDOWN)
 
-            for i, period in enumerate(time_periods, 1):
+            # 各时段的AI请求互不依赖，并发发起，用信号量限制同时进行的请求数，
+            # 用速率限制器控制发起请求的频率
+            semaphore = asyncio.Semaphore(max(1, config.daily_summary_period_concurrency))
+
+            async def summarize_period(period_messages, period_name):
+                async with semaphore, self._ai_limiter:
+                    return await self.ai_summary.generate_period_summary(period_messages, period_name, deferrable=True)
+
+            # 只解析一次时间戳，单次遍历把每条消息分到所属时段，同时统计用户活跃度
+            user_stats = Counter()
+            period_buckets = self._group_messages_by_period(messages, _TIME_PERIODS, user_stats)
+            pending_periods = [
+                (period, period_buckets[period[0]])
+                for period in _TIME_PERIODS
+                if period_buckets[period[0]]
+            ]
+
+            summaries = await asyncio.gather(
+                *(summarize_period(period_messages, period[0]) for period, period_messages in pending_periods),
+                return_exceptions=True
+            )
+
+            # 已攒下的内容按转换为MarkdownV2之后的长度累计
+            pending_summaries = [header]
+            pending_len = _markdown_v2_length(header) + 2
+
+            for ((period_name, period_start, period_end), period_messages), summary in zip(pending_periods, summaries):
                 try:
-                    period_messages = self._filter_messages_by_time_range(messages, period["start"], period["end"])
-
-                    if period_messages:
-                        # 不再限制消息数量，让AI处理所有消息以生成更全面的总结
-                        summary = self.ai_summary.generate_period_summary(period_messages, period['name'])
-
-                        if summary:
-                            if summary.startswith("错误"):
-                                # 记录错误但继续处理其他时段
-                                error_msg = f"{period['name']}时段总结错误: {summary}"
-                                error_messages.append(error_msg)
-                                result['errors'].append(error_msg)
-                                self.logger.error(f"Summary error for chat {chat_id}, period {period['name']}: {summary}")
-                            elif not summary.startswith("没有消息"):
-                                # 构建时段标题和总结
-                                period_summary = f"**{period['name']} ({period['start']}-{period['end']})**\n{summary}"
-                                # 使用分割发送方法，确保每条消息 < 1000 字符
-                                await self.safe_send_and_split(chat_id, period_summary)
-                                result['periods_processed'] += 1
-                                total_messages_processed += len(period_messages)
-                        else:
-                            error_msg = f"{period['name']}时段总结返回空结果"
-                            error_messages.append(error_msg)
-                            result['errors'].append(error_msg)
-                            self.logger.warning(f"Empty summary for chat {chat_id}, period {period['name']}")
-
-                        # 在每个时间段总结请求后添加延迟
-                        await asyncio.sleep(config.daily_summary_period_interval)
+                    if isinstance(summary, Exception):
+                        raise summary
+
+                    if summary:
+                        if summary.startswith("错误"):
+                            # 记录错误但继续处理其他时段
+                            error_msg = f"{period_name}时段总结错误: {summary}"
+                            push_error(error_msg)
+                            self.logger.error(f"Summary error for chat {chat_id}, period {period_name}: {summary}")
+                        elif not summary.startswith("没有消息"):
+                            # 构建时段标题和总结
+                            period_summary = f"**{period_name} ({period_start}-{period_end})**\n{summary}"
+                            # 多个时段的总结拼接成一条消息，接近单条消息上限时才发送，减少API调用
+                            summary_len = _markdown_v2_length(period_summary)
+                            if pending_len and pending_len + summary_len + 2 > _MESSAGE_CHUNK_LIMIT:
+                                await self.safe_send_and_split(chat_id, "\n\n".join(pending_summaries))
+                                pending_summaries = []
+                                pending_len = 0
+                            pending_summaries.append(period_summary)
+                            pending_len += summary_len + 2
+                            result['periods_processed'] += 1
+                            total_messages_processed += len(period_messages)
+                    else:
+                        error_msg = f"{period_name}时段总结返回空结果"
+                        push_error(error_msg)
+                        self.logger.warning(f"Empty summary for chat {chat_id}, period {period_name}")
 
                 except Exception as e:
-                    error_msg = f"{period['name']}时段处理异常: {str(e)}"
-                    error_messages.append(error_msg)
-                    result['errors'].append(error_msg)
-                    self.logger.error(f"Error processing period {period['name']} for chat {chat_id}: {e}")
+                    error_msg = f"{period_name}时段处理异常: {str(e)}"
+                    push_error(error_msg)
+                    self.logger.error(f"Error processing period {period_name} for chat {chat_id}: {e}")
                     continue
 
             result['total_messages'] = total_messages_processed
 
-            # 生成活跃成员排行
-            user_stats = {}
-            for msg in messages:
-                user = msg.get('user', 'Unknown')
-                user_stats[user] = user_stats.get(user, 0) + 1
-
             # 排序获取前10名活跃用户
-            top_users = sorted(user_stats.items(), key=lambda x: x[1], reverse=True)[:10]
+            top_users = user_stats.most_common(10)
 
-            # 构建统计信息
-            stats_text = f"📝 消息总数: {total_messages_processed} 条\n"
-            stats_text += f"👥 活跃用户: {len(user_stats)} 人\n\n"
+            # 构建统计信息，各部分收集到列表中最后一次拼接
+            stats_parts = [
+                f"📝 消息总数: {total_messages_processed} 条\n",
+                f"👥 活跃用户: {len(user_stats)} 人\n\n"
+            ]
 
             # 添加活跃成员排行
             if top_users:
-                stats_text += "🏆 **今日活跃用户排行:**\n"
-                for i, (user, count) in enumerate(top_users, 1):
-                    stats_text += f"{i}. {user}: {count} 条消息\n"
-                stats_text += "\n"
+                stats_parts.append("🏆 **今日活跃用户排行:**\n")
+                stats_parts.extend(f"{i}. {user}: {count} 条消息\n" for i, (user, count) in enumerate(top_users, 1))
+                stats_parts.append("\n")
 
             # 如果有错误，添加错误信息（限制显示前5个错误）
-            if error_messages:
-                stats_text += "⚠️ **处理过程中遇到的问题:**\n"
-                stats_text += "\n".join([f"- {err}" for err in error_messages[:5]])
+            if result['errors']:
+                stats_parts.append("⚠️ **处理过程中遇到的问题:**\n")
+                stats_parts.append("\n".join(f"- {err}" for err in islice(result['errors'], 5)))
+
+            stats_text = "".join(stats_parts)
 
-            # 使用安全发送方法发送统计信息
+            # 根据处理结果确定状态
             if total_messages_processed > 0:
-                result['status'] = 'success' if not error_messages else 'partial'
+                result['status'] = 'success' if not result['errors'] else 'partial'
             else:
                 stats_text = "📭 今日无有效话题讨论"
                 result['status'] = 'no_messages'
 
-            await self.safe_send_message(chat_id, stats_text, parse_mode=ParseMode.MARKDOWN)
+            # 统计信息放得下时和剩余的总结一起发送，否则先发送总结
+            if pending_summaries and pending_len + _markdown_v2_length(stats_text) > _MESSAGE_CHUNK_LIMIT:
+                await self.safe_send_and_split(chat_id, "\n\n".join(pending_summaries))
+                pending_summaries = []
+            pending_summaries.append(stats_text)
+            # 使用分割发送方法，超过单条消息上限的总结会被切分
+            await self.safe_send_and_split(chat_id, "\n\n".join(pending_summaries))
             result['summary_sent'] = True
 
             self.logger.info(f"Daily summary sent to chat {chat_id}, result: {result}")
@@ -625,7 +904,7 @@ class TelegramBot:
             error_msg = f"生成每日总结时发生严重错误: {str(e)}"
             self.logger.error(f"Error sending daily summary to chat {chat_id}: {e}")
 
-            result['errors'].append(error_msg)
+            push_error(error_msg)
 
             try:
                 # 发送错误信息到群组
@@ -635,7 +914,7 @@ class TelegramBot:
 ⚠️ 错误: {str(e)}
 """
                 if result['errors']:
-                    error_notification += "\n📋 详细错误:\n" + "\n".join([f"- {err}" for err in result['errors'][:5]])
+                    error_notification += "\n📋 详细错误:\n" + "\n".join(f"- {err}" for err in islice(result['errors'], 5))
 
                 await self.safe_send_message(chat_id, error_notification)
             except Exception as send_error:
@@ -646,121 +925,101 @@ class TelegramBot:
     async def safe_send_and_split(self, chat_id, text, use_markdown=True):
         """
         安全发送消息，自动分割超过长度的消息
-        每条消息限制在1000字符以内
+        每条消息限制在 _MESSAGE_CHUNK_LIMIT 字符以内，使用Markdown时按转换为MarkdownV2之后的长度计算
         默认使用Markdown格式，但可以禁用
         """
-        # 如果消息已经小于1000，直接发送
-        if len(text) <= 1000:
+        # 如果消息没有超过长度限制，直接发送
+        if (_markdown_v2_length(text) if use_markdown else len(text)) <= _MESSAGE_CHUNK_LIMIT:
             if use_markdown:
                 return await self.safe_send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN)
             else:
                 return await self.safe_send_message(chat_id, text)
 
-        # 否则分割消息
+        # 否则分割消息，当前部分的行先收集到列表中，保存时才拼接
         message_parts = []
-        current_part = ""
-        lines = text.split('\n')
-
-        for line in lines:
-            # 如果添加这行会超过1000字符，先保存当前部分
-            if len(current_part) + len(line) + 1 > 1000:  # +1 是换行符
-                if current_part:
-                    message_parts.append(current_part)
-                    current_part = ""
-
-            # 如果单行就超过1000字符，需要强制分割
-            if len(line) > 1000:
-                # 添加当前部分（如果有）
-                if current_part:
-                    message_parts.append(current_part)
-                    current_part = ""
-
-                # 强制分割长行
-                for i in range(0, len(line), 1000):
-                    message_parts.append(line[i:i+1000])
-            else:
+        current_lines = []
+        current_len = 0
+        # 逐行转义后的长度不小于转换为MarkdownV2后的长度；强制分割时最坏情况每个字符都要转义
+        split_step = _MESSAGE_CHUNK_LIMIT // 2 if use_markdown else _MESSAGE_CHUNK_LIMIT
+
+        for line in text.split('\n'):
+            line_len = len(_escape_markdown_v2(line)) if use_markdown else len(line)
+
+            # 如果添加这行会超过长度限制，先保存当前部分
+            if current_len and current_len + line_len + 1 > _MESSAGE_CHUNK_LIMIT:  # +1 是换行符
+                message_parts.append('\n'.join(current_lines))
+                current_lines = []
+                current_len = 0
+
+            # 如果单行就超过长度限制，需要强制分割
+            if line_len > _MESSAGE_CHUNK_LIMIT:
+                message_parts.extend(line[i:i+split_step] for i in range(0, len(line), split_step))
+            elif current_len:
                 # 正常添加行
-                if current_part:
-                    current_part += '\n' + line
-                else:
-                    current_part = line
+                current_lines.append(line)
+                current_len += line_len + 1
+            else:
+                current_lines = [line]
+                current_len = line_len
 
         # 添加最后一部分
-        if current_part:
-            message_parts.append(current_part)
+        if current_len:
+            message_parts.append('\n'.join(current_lines))
 
-        # 发送所有部分
+        # 发送所有部分，由群组限速器控制速率，被限流时safe_send_message按Retry-After等待
         sent_messages = []
+        limiter = self._get_chat_limiter(chat_id)
         for i, part in enumerate(message_parts):
             try:
-                if use_markdown:
-                    msg = await self.safe_send_message(chat_id, part, parse_mode=ParseMode.MARKDOWN)
-                else:
-                    msg = await self.safe_send_message(chat_id, part)
+                async with limiter:
+                    if use_markdown:
+                        msg = await self.safe_send_message(chat_id, part, parse_mode=ParseMode.MARKDOWN)
+                    else:
+                        msg = await self.safe_send_message(chat_id, part)
 
                 if msg:
                     sent_messages.append(msg)
-                if i < len(message_parts) - 1:
-                    await asyncio.sleep(0.5)  # 避免发送太快
             except Exception as e:
                 self.logger.error(f"Failed to send message part {i+1}: {e}")
 
         return sent_messages[0] if sent_messages else None
 
-    def _filter_messages_by_time_range(self, messages: List[Dict[str, Any]], start_time: str, end_time: str) -> List[Dict[str, Any]]:
-        """根据时间范围过滤消息"""
-        from datetime import datetime, time
-
-        # 解析时间
-        start_hour, start_minute = map(int, start_time.split(':'))
-        end_hour, end_minute = map(int, end_time.split(':'))
+    def _group_messages_by_period(self, messages: List[Dict[str, Any]],
+                                  time_periods: Tuple[Tuple[str, str, str], ...],
+                                  user_stats: Optional[Counter] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        单次遍历通过分钟->时段表把每条消息直接放入所属时段
+        传入user_stats时同时统计每个用户的消息数
+        """
+        if time_periods is _TIME_PERIODS:
+            period_by_minute = _PERIOD_BY_MINUTE
+        else:
+            period_by_minute = _build_period_minute_table(time_periods)
+        period_buckets = [[] for _ in time_periods]
 
-        start_dt = time(start_hour, start_minute)
-        end_dt = time(end_hour, end_minute)
+        if user_stats is not None:
+            # 整批交给Counter计数，取用户名和计数都在C层完成
+            user_stats.update(map(_get_message_user, messages))
 
-        filtered_messages = []
+        # 循环中用到的函数先绑定到局部变量
+        message_time = get_message_time
+        bucket_appends = [bucket.append for bucket in period_buckets]
 
         for msg in messages:
-            try:
-                # 解析消息时间
-                msg_time_str = msg.get('timestamp', '')
-                if msg_time_str:
-                    try:
-                        # 解析消息时间戳，保持时区信息或添加UTC时区
-                        if 'Z' in msg_time_str or '+' in msg_time_str:
-                            # 如果有时区信息，直接解析并转换为本地时间
-                            utc_time = datetime.fromisoformat(msg_time_str.replace('Z', '+00:00'))
-                            local_time = utc_time.astimezone().replace(tzinfo=None)
-                        else:
-                            # 如果没有时区信息，假设为本地时间
-                            local_time = datetime.fromisoformat(msg_time_str)
-
-                        msg_time_only = local_time.time()
-
-                        # 检查消息是否在时间范围内
-                        if start_time <= end_time:
-                            # 正常情况：06:00-12:00 或 18:00-23:59
-                            if start_dt <= msg_time_only <= end_dt:
-                                filtered_messages.append(msg)
-                        else:
-                            # 跨日情况：00:00-06:00
-                            if msg_time_only >= start_dt or msg_time_only < end_dt:
-                                filtered_messages.append(msg)
-                    except Exception as e:
-                        self.logger.debug(f"Error parsing message time {msg_time_str}: {e}")
-                        continue
-
-            except Exception as e:
-                self.logger.debug(f"Error processing message time: {e}")
-                continue
+            msg_dt = message_time(msg)
+            if msg_dt is not None:
+                index = period_by_minute[msg_dt.hour * 60 + msg_dt.minute]
+                if index is not None:
+                    bucket_appends[index](msg)
 
-        return filtered_messages
+        return {name: bucket for (name, _, _), bucket in zip(time_periods, period_buckets)}
 
     def setup_handlers(self) -> None:
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("summary", self.summary_command))
-        self.application.add_handler(CommandHandler("dailysummary", self.daily_summary_command))
+        # 生成总结要等待AI接口，不阻塞其他更新的处理；同一群组重复的 /summary 才能合并为一次生成
+        self.application.add_handler(CommandHandler("summary", self.summary_command, block=False))
+        self.application.add_handler(CommandHandler("dailysummary", self.daily_summary_command, block=False))
         self.application.add_handler(CommandHandler("schedulerstatus", self.scheduler_status_command))
         self.application.add_handler(CommandHandler("stats", self.stats_command))
 
@@ -769,14 +1028,36 @@ class TelegramBot:
         message_filter = filters.TEXT & ~filters.COMMAND
         self.application.add_handler(MessageHandler(message_filter, self.handle_message))
 
+        # 放在最后一组，更新被其他处理器处理完后才记录
+        self.application.add_handler(TypeHandler(Update, self.track_update), group=1)
+
     async def start(self) -> None:
         if not self.bot_token:
             self.logger.error("Bot token not configured!")
             return
 
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        stop_signals = self._install_signal_handlers()
+        # asyncio.to_thread 使用的线程池：消息文件读写、偏移量保存都在这里执行，不阻塞事件循环
+        self._loop.set_default_executor(ThreadPoolExecutor(max_workers=_IO_THREADS, thread_name_prefix="storage-io"))
+
         try:
-            # 创建Application
-            builder = Application.builder().token(self.bot_token)
+            # 创建Application，所有Bot API调用共用一个保持连接的连接池，
+            # getUpdates长轮询单独使用一个连接
+            request = HTTPXRequest(
+                connection_pool_size=20,
+                read_timeout=30,
+                write_timeout=30,
+                http_version=_TELEGRAM_HTTP_VERSION
+            )
+            get_updates_request = HTTPXRequest(http_version=_TELEGRAM_HTTP_VERSION)
+            builder = (
+                Application.builder()
+                .token(self.bot_token)
+                .request(request)
+                .get_updates_request(get_updates_request)
+            )
             self.application = builder.build()
 
             self.setup_handlers()
@@ -788,56 +1069,78 @@ class TelegramBot:
             self.logger.info("Bot started successfully!")
 
             await self.application.initialize()
+
+            if self._last_update_id is not None:
+                # 向Telegram确认重启前已处理过的更新，之后只会收到新的更新
+                await self.application.bot.get_updates(offset=self._last_update_id + 1, timeout=0, limit=1)
+
             await self.application.start()
-            await self.application.updater.start_polling(drop_pending_updates=True)
+            # 首次启动没有记录时丢弃积压的更新，避免重放大量旧消息
+            await self.application.updater.start_polling(drop_pending_updates=self._last_update_id is None)
 
-            # 保持机器人运行
+            # 保持机器人运行，直到 stop() 设置停止事件；处理进度由 track_update 按需保存
             self.logger.info("Bot is now running. Press Ctrl+C to stop.")
-            while True:
-                await asyncio.sleep(1)
+            await self._stop_event.wait()
 
         except Exception as e:
             self.logger.error(f"Error starting bot: {e}")
             # 简化异常处理，避免在异常时进行复杂清理
             self.logger.info("Bot will exit due to error")
 
-    def stop(self) -> None:
-        self.logger.info("Stopping bot...")
+        finally:
+            for sig in stop_signals:
+                self._loop.remove_signal_handler(sig)
+            # 事件循环仍在运行时完成清理，asyncio.run() 返回后循环已关闭
+            await self._shutdown()
 
-        if self.scheduler:
-            self.scheduler.stop()
-
-        if self.application:
+    def _install_signal_handlers(self) -> List[int]:
+        """SIGINT/SIGTERM 只设置停止事件，由 start() 正常返回；平台不支持时（如Windows）保留默认的 KeyboardInterrupt"""
+        installed = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                # 尝试获取当前事件循环，但不强制
-                loop = None
-                try:
-                    loop = asyncio.get_event_loop()
-                except RuntimeError:
-                    pass
+                self._loop.add_signal_handler(sig, self._on_stop_signal)
+            except (NotImplementedError, RuntimeError):
+                continue
+            installed.append(sig)
+        return installed
 
-                if loop and not loop.is_closed():
-                    if loop.is_running():
-                        loop.create_task(self._cleanup())
-                    else:
-                        loop.run_until_complete(self._cleanup())
-                else:
-                    # 事件循环已关闭，只进行简单清理
-                    self.logger.info("Event loop closed, skipping async cleanup")
+    def _on_stop_signal(self) -> None:
+        self.logger.info("Received interrupt signal, shutting down...")
+        self._stop_event.set()
 
-            except Exception as e:
-                self.logger.error(f"Error during cleanup: {e}")
+    def stop(self) -> None:
+        """请求停止机器人，唤醒 start() 中等待的主协程并由其完成清理，可以在其他线程中调用"""
+        if self._stop_event is not None and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop_event.set)
 
-        self.logger.info("Bot stopped")
+    async def _shutdown(self) -> None:
+        """依次停止调度器、轮询和Application，保存处理进度，写入缓冲中的消息，最后关闭AI客户端"""
+        self.logger.info("Stopping bot...")
 
-    async def _cleanup(self):
-        if self.application:
+        if self.scheduler and self.scheduler.running:
+            # 正在执行的每日总结要在Application和AI客户端关闭之前结束
+            summary_task = self.scheduler.stop()
+            if summary_task is not None:
+                await asyncio.gather(summary_task, return_exceptions=True)
+
+        application = self.application
+        if application:
             try:
-                # 只关闭updater，避免完全关闭application
-                if hasattr(self.application, 'updater') and self.application.updater:
-                    await self.application.updater.stop()
+                updater = application.updater
+                if updater and updater.running:
+                    await updater.stop()
+                if application.running:
+                    await application.stop()
+                await application.shutdown()
             except Exception as e:
                 self.logger.error(f"Error during cleanup: {e}")
 
+        self._save_update_offset()
+        self.storage.flush_all()
 
-__all__ = ['TelegramBot']
\ No newline at end of file
+        try:
+            await self.ai_summary.close()
+        except Exception as e:
+            self.logger.error(f"Error closing AI client: {e}")
+
+        self.logger.info("Bot stopped")
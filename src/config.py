@@ -1,19 +1,50 @@
+import asyncio
+import atexit
 import json
+import logging
 import os
-from typing import Dict, Any
+from contextlib import contextmanager
+from typing import Dict, Any, FrozenSet, Iterable, Optional
+
+from . import fastjson
+
+logger = logging.getLogger(__name__)
+
+
+def _coerce_chat_ids(chats: Iterable[Any]) -> FrozenSet[int]:
+    """把配置中的群组ID统一转换为int（JSON中常写成字符串，如 "-100123"），无法转换的跳过并记录警告"""
+    chat_ids = set()
+    for chat in chats:
+        try:
+            chat_ids.add(int(chat))
+        except (TypeError, ValueError):
+            logger.warning("Ignoring invalid chat id in telegram.allowed_chats: %r", chat)
+    return frozenset(chat_ids)
 
 
 class Config:
+    # 属性固定，不需要实例 __dict__
+    __slots__ = ('config_path', '_config', '_flat', '_allowed_chats', '_dirty', '_save_handle', '_batch_depth')
+
     def __init__(self, config_path: str = "config.json"):
         self.config_path = config_path
         self._config: Dict[str, Any] = {}
+        # 所有点分路径到值的展开表，get() 只需一次字典查找
+        self._flat: Dict[str, Any] = {}
+        self._allowed_chats: FrozenSet[int] = frozenset()
+        # set() 之后尚未写入磁盘的修改，以及在事件循环中延迟写入的定时器
+        self._dirty = False
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_depth = 0
         self.load_config()
+        # 退出时写入尚未保存的修改
+        atexit.register(self.flush)
 
     def load_config(self) -> None:
         if os.path.exists(self.config_path):
             try:
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    self._config = json.load(f)
+                with open(self.config_path, 'rb') as f:
+                    self._config = fastjson.loads(f.read())
             except (json.JSONDecodeError, IOError) as e:
                 print(f"Error loading config: {e}")
                 self._config = self.get_default_config()
@@ -22,10 +53,27 @@ class Config:
             self._config = self.get_default_config()
             self.save_config()
 
+        self._rebuild_flat()
+
+    def _rebuild_flat(self) -> None:
+        flat: Dict[str, Any] = {}
+
+        def walk(prefix: str, node: Dict[str, Any]) -> None:
+            for k, v in node.items():
+                path = f"{prefix}.{k}" if prefix else k
+                flat[path] = v
+                if isinstance(v, dict):
+                    walk(path, v)
+
+        walk("", self._config)
+        self._flat = flat
+        # 允许的群组在加载和修改时转换为int的frozenset，判断时只需一次哈希查找
+        self._allowed_chats = _coerce_chat_ids(flat.get("telegram.allowed_chats") or ())
+
     def save_config(self) -> None:
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(self._config, f, indent=2, ensure_ascii=False)
+            with open(self.config_path, 'wb') as f:
+                f.write(fastjson.dumps(self._config, indent=True))
         except IOError as e:
             print(f"Error saving config: {e}")
 
@@ -41,7 +89,15 @@ class Config:
                 "api_key": "",
                 "model": "gpt-3.5-turbo",
                 "max_tokens": 128000,
-                "temperature": 0.7
+                "temperature": 0.7,
+                "stream_enabled": True,
+                "cache_enabled": True,
+                "cache_ttl_seconds": 86400,
+                "batch_enabled": False,
+                "batch_window_seconds": 30,
+                "batch_poll_interval_seconds": 30,
+                "batch_timeout_seconds": 3600,
+                "requests_per_second": 2
             },
             "storage": {
                 "data_dir": "data",
@@ -53,7 +109,8 @@ class Config:
                 "manual_summary_message_count": 100,
                 "manual_summary_hours": 24,
                 "timezone_offset_hours": 0,
-                "daily_summary_period_interval": 30
+                "daily_summary_period_concurrency": 4,
+                "daily_summary_chat_concurrency": 5
             },
             "logging": {
                 "level": "INFO",
@@ -62,14 +119,7 @@ class Config:
         }
 
     def get(self, key: str, default: Any = None) -> Any:
-        keys = key.split('.')
-        value = self._config
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
-            else:
-                return default
-        return value
+        return self._flat.get(key, default)
 
     def set(self, key: str, value: Any) -> None:
         keys = key.split('.')
@@ -79,15 +129,50 @@ class Config:
                 config[k] = {}
             config = config[k]
         config[keys[-1]] = value
-        self.save_config()
+        self._rebuild_flat()
+        self._dirty = True
+
+        # batch() 中的修改在退出时一起写入
+        if self._batch_depth:
+            return
+
+        # 在事件循环中运行时延迟0.5秒写入，期间的多次修改合并为一次写入
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        if self._save_handle is None:
+            self._save_handle = loop.call_later(0.5, self.flush)
+
+    def flush(self) -> None:
+        """把尚未保存的修改写入配置文件"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if self._dirty:
+            self._dirty = False
+            self.save_config()
+
+    @contextmanager
+    def batch(self):
+        """批量修改配置，期间不写入磁盘，退出时只写入一次"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush()
 
     @property
     def bot_token(self) -> str:
         return self.get("telegram.bot_token", "")
 
     @property
-    def allowed_chats(self) -> list:
-        return self.get("telegram.allowed_chats", [])
+    def allowed_chats(self) -> FrozenSet[int]:
+        return self._allowed_chats
 
     @property
     def allow_bot_messages(self) -> bool:
@@ -105,6 +190,10 @@ class Config:
     def model(self) -> str:
         return self.get("ai.model", "gpt-3.5-turbo")
 
+    @property
+    def ai_requests_per_second(self) -> float:
+        return self.get("ai.requests_per_second", 2)
+
     @property
     def data_dir(self) -> str:
         return self.get("storage.data_dir", "data")
@@ -130,8 +219,12 @@ class Config:
         return self.get("summary.timezone_offset_hours", 0)
 
     @property
-    def daily_summary_period_interval(self) -> int:
-        return self.get("summary.daily_summary_period_interval", 30)
+    def daily_summary_period_concurrency(self) -> int:
+        return self.get("summary.daily_summary_period_concurrency", 4)
+
+    @property
+    def daily_summary_chat_concurrency(self) -> int:
+        return self.get("summary.daily_summary_chat_concurrency", 5)
 
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""
+JSON编解码工具
+
+安装了 orjson 时使用其C实现，否则退回标准库 json。
+解析失败时两种实现都抛出 json.JSONDecodeError（orjson.JSONDecodeError 是其子类）。
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON，默认紧凑格式，indent=True 时缩进两个空格，sort_keys=True 时按键排序"""
+    if orjson is not None:
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, option=option) if option else orjson.dumps(obj)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False, sort_keys=sort_keys).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys).encode('utf-8')
+
+
+__all__ = ['loads', 'dumps']
@@ -0,0 +1,50 @@
+"""
+异步速率限制
+
+令牌桶实现，不依赖具体的事件循环，可以在调度器线程创建的事件循环中共用同一个实例。
+"""
+import asyncio
+import time
+
+
+class AsyncRateLimiter:
+    """
+    限制每 time_period 秒最多放行 max_rate 次，允许突发 max_rate 次
+
+    用法:
+        limiter = AsyncRateLimiter(2, 1)
+        async with limiter:
+            await do_request()
+
+    max_rate <= 0 时不做限制。
+    """
+
+    def __init__(self, max_rate: float, time_period: float = 1.0):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = float(max_rate)
+        self._last = time.monotonic()
+
+    async def acquire(self) -> None:
+        if self.max_rate <= 0:
+            return
+
+        rate = self.max_rate / self.time_period
+        now = time.monotonic()
+        self._tokens = min(self.max_rate, self._tokens + (now - self._last) * rate)
+        self._last = now
+
+        # 先预留令牌再等待，并发调用者依次排在后面，不会同时醒来
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / rate)
+
+    async def __aenter__(self) -> "AsyncRateLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+__all__ = ['AsyncRateLimiter']
@@ -1,19 +1,47 @@
 import asyncio
-import threading
 from datetime import time, datetime, date, timedelta
 from typing import Optional, Callable
 import logging
+from collections import Counter
+from time import monotonic
 
 from src.config import config
 from src.storage import MessageStorage
 
 
+# 向所有群组发送严重错误通知的总超时时间
+_NOTIFY_TIMEOUT_SECONDS = 30
+
+# 发送到群组的失败通知模板
+_CHAT_ERROR_TEMPLATE = "❌ **每日总结任务执行失败**\n\n{error}"
+
+_GLOBAL_ERROR_TEMPLATE = """
+🚨 **每日总结任务严重错误**
+
+⚠️ 错误信息: {error}
+
+这个错误影响了整个每日总结任务，可能是配置问题或系统错误，请检查日志文件获取详细信息。
+"""
+
+
 class DailySummaryScheduler:
+    # 属性固定，不需要实例 __dict__
+    __slots__ = (
+        'bot_instance', 'storage', 'running', '_target_time', '_target_seconds', 'logger',
+        '_loop', '_handle', '_task', '_next_run', '_deadline'
+    )
+
     def __init__(self, bot_instance):
         self.bot_instance = bot_instance
-        self.storage = MessageStorage()
+        # 与机器人共用同一个存储对象，共享群组目录和群组列表的缓存
+        self.storage = getattr(bot_instance, 'storage', None) or MessageStorage()
         self.running = False
-        self.scheduler_thread = None
+        # 调度器运行在机器人的事件循环上：_handle 是等待下次执行的定时器，_task 是正在执行的总结任务
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_run: Optional[datetime] = None
+        self._deadline = 0.0
         self.target_time = self.parse_time(config.daily_summary_time)
         self.logger = logging.getLogger(__name__)
 
@@ -25,20 +53,27 @@ class DailySummaryScheduler:
         except (ValueError, AttributeError):
             return time(23, 59)
 
+    @property
+    def target_time(self) -> time:
+        return self._target_time
+
+    @target_time.setter
+    def target_time(self, value: time) -> None:
+        # 同时记下目标时间是一天中的第几秒，计算等待时间时只需整数运算
+        self._target_time = value
+        self._target_seconds = value.hour * 3600 + value.minute * 60 + value.second
+
     def seconds_until_target_time(self) -> int:
         """计算距离下次本地时间的目标时间还有多少秒"""
         local_now = datetime.now()
-        local_date = local_now.date()
+        # 运行中时直接使用已挂定时器的目标时间，不再重新计算
+        next_run = self._next_run
+        if next_run is not None and local_now < next_run:
+            return int((next_run - local_now).total_seconds())
 
-        # 创建本地时间的目标时间
-        target_dt = datetime.combine(local_date, self.target_time)
-
-        # 如果目标时间已经过了，设置为明天
-        if local_now >= target_dt:
-            target_dt = target_dt + timedelta(days=1)
-
-        delta = target_dt - local_now
-        return int(delta.total_seconds())
+        # 目标时间已过时等到明天的同一时间
+        current_seconds = local_now.hour * 3600 + local_now.minute * 60 + local_now.second
+        return (self._target_seconds - current_seconds) % 86400 or 86400
 
     async def send_daily_summaries(self):
         """发送每日总结到所有群组，返回所有群组的执行结果"""
@@ -53,15 +88,17 @@ class DailySummaryScheduler:
             'errors': []
         }
 
+        # 耗时用单调时钟计算，不受系统时间调整影响
+        started = monotonic()
+
         try:
-            local_now = datetime.now()
-            self.logger.info(f"Starting daily summaries at local time: {local_now.strftime('%Y-%m-%d %H:%M:%S')}")
+            self.logger.info("Starting daily summaries")
 
             # 获取所有群组列表
-            chat_ids = self.storage.get_chat_list()
+            chat_ids = await asyncio.to_thread(self.storage.get_chat_list)
             execution_report['total_chats'] = len(chat_ids)
 
-            self.logger.info(f"Found {len(chat_ids)} chats to process")
+            self.logger.info("Found %d chats to process", len(chat_ids))
 
             if not chat_ids:
                 error_msg = "No chats configured, cannot send daily summaries"
@@ -69,61 +106,55 @@ class DailySummaryScheduler:
                 execution_report['errors'].append(error_msg)
                 return execution_report
 
-            # 为每个群组生成总结
-            for idx, chat_id in enumerate(chat_ids, 1):
-                try:
-                    self.logger.info(f"[{idx}/{len(chat_ids)}] Processing chat {chat_id}")
+            # 各群组的总结互不依赖，并发处理，用信号量限制同时处理的群组数；
+            # 每个群组的发送速率由机器人的群组限速器控制，不再在群组之间固定等待
+            semaphore = asyncio.Semaphore(max(1, config.daily_summary_chat_concurrency))
+            total = len(chat_ids)
 
-                    # 获取保存的群组信息用于日志
-                    chat_info = f"chat_{chat_id}"
-                    try:
-                        # 尝试获取群组名称等信息（如果可用）
-                        pass
-                    except:
-                        pass
-
-                    # 发送每日总结并获取结果报告
-                    result = await self.bot_instance.send_daily_summary(chat_id)
-
-                    # 记录结果
-                    execution_report['chat_results'][chat_id] = result
-
-                    # 统计汇总
-                    if result.get('status') == 'success':
-                        execution_report['successful'] += 1
-                    elif result.get('status') == 'partial':
-                        execution_report['partial'] += 1
-                    elif result.get('status') == 'no_messages':
-                        execution_report['no_messages'] += 1
-                    else:
-                        execution_report['failed'] += 1
-
-                    if result.get('errors'):
-                        execution_report['errors'].extend([f"Chat {chat_id}: {err}" for err in result['errors']])
-
-                    self.logger.info(f"[{idx}/{len(chat_ids)}] Completed chat {chat_id}, status: {result.get('status')}")
-
-                    # 群组间增加间隔避免触发限制
-                    if idx < len(chat_ids):
-                        await asyncio.sleep(3)
-
-                except Exception as e:
-                    error_msg = f"Failed to send summary to chat {chat_id}: {e}"
-                    self.logger.error(error_msg)
-                    execution_report['failed'] += 1
-                    execution_report['errors'].append(error_msg)
-
-                    # 尝试发送错误信息到群组
+            async def process_chat(idx, chat_id):
+                async with semaphore:
                     try:
-                        await self.bot_instance.safe_send_message(chat_id, f"❌ **每日总结任务执行失败**\n\n{error_msg}")
-                    except Exception as send_error:
-                        self.logger.error(f"Failed to send error message to chat {chat_id}: {send_error}")
+                        self.logger.info("[%d/%d] Processing chat %s", idx, total, chat_id)
+
+                        # 发送每日总结并获取结果报告
+                        result = await self.bot_instance.send_daily_summary(chat_id)
+
+                        # 记录结果
+                        execution_report['chat_results'][chat_id] = result
+
+                        if result.get('errors'):
+                            execution_report['errors'].extend([f"Chat {chat_id}: {err}" for err in result['errors']])
+
+                        self.logger.info("[%d/%d] Completed chat %s, status: %s", idx, total, chat_id, result.get('status'))
+                        return result.get('status')
+
+                    except Exception as e:
+                        error_msg = f"Failed to send summary to chat {chat_id}: {e}"
+                        self.logger.error(error_msg)
+                        execution_report['errors'].append(error_msg)
+
+                        # 尝试发送错误信息到群组
+                        try:
+                            await self.bot_instance.safe_send_message(chat_id, _CHAT_ERROR_TEMPLATE.format(error=error_msg))
+                        except Exception as send_error:
+                            self.logger.error("Failed to send error message to chat %s: %s", chat_id, send_error)
+                        return 'failed'
+
+            # 为每个群组生成总结，全部完成后一次统计各状态的群组数，未知状态计为失败
+            statuses = await asyncio.gather(*(process_chat(idx, chat_id) for idx, chat_id in enumerate(chat_ids, 1)))
+            status_counts = Counter(statuses)
+            execution_report['successful'] = status_counts['success']
+            execution_report['partial'] = status_counts['partial']
+            execution_report['no_messages'] = status_counts['no_messages']
+            execution_report['failed'] = len(statuses) - (
+                execution_report['successful'] + execution_report['partial'] + execution_report['no_messages']
+            )
 
             # 计算执行统计
             execution_report['end_time'] = datetime.now()
-            execution_report['duration_seconds'] = (execution_report['end_time'] - execution_report['start_time']).total_seconds()
+            execution_report['duration_seconds'] = monotonic() - started
 
-            self.logger.info(f"Daily summary task completed: {execution_report}")
+            self.logger.info("Daily summary task completed: %s", execution_report)
 
             return execution_report
 
@@ -134,141 +165,116 @@ class DailySummaryScheduler:
 
             # 如果是全局错误，尝试通知所有群组
             try:
-                chat_ids = self.storage.get_chat_list()
+                chat_ids = await asyncio.to_thread(self.storage.get_chat_list)
                 if not chat_ids:
                     self.logger.error("No chats to notify about global error")
                     return execution_report
 
-                for chat_id in chat_ids:
-                    try:
-                        global_error_msg = f"""
-🚨 **每日总结任务严重错误**
-
-⚠️ 错误信息: {str(e)}
+                global_error_msg = _GLOBAL_ERROR_TEMPLATE.format(error=e)
+                # 同时通知所有群组，各群组的发送速率由机器人的群组限速器控制；
+                # 整体限时，Telegram无响应时也不会一直卡在这里
+                try:
+                    send_results = await asyncio.wait_for(
+                        asyncio.gather(
+                            *(self.bot_instance.safe_send_message(chat_id, global_error_msg) for chat_id in chat_ids),
+                            return_exceptions=True
+                        ),
+                        timeout=_NOTIFY_TIMEOUT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    self.logger.error("Timed out sending global error notifications after %ss", _NOTIFY_TIMEOUT_SECONDS)
+                    return execution_report
 
-这个错误影响了整个每日总结任务，可能是配置问题或系统错误，请检查日志文件获取详细信息。
-"""
-                        await self.bot_instance.safe_send_message(chat_id, global_error_msg)
-                    except Exception as send_error:
-                        self.logger.error(f"Failed to send global error message to chat {chat_id}: {send_error}")
+                for chat_id, send_result in zip(chat_ids, send_results):
+                    if isinstance(send_result, Exception):
+                        self.logger.error("Failed to send global error message to chat %s: %s", chat_id, send_result)
             except Exception as global_error:
-                self.logger.error(f"Failed to send global error notifications: {global_error}")
+                self.logger.error("Failed to send global error notifications: %s", global_error)
 
             return execution_report
 
-    def scheduler_loop(self):
-        self.logger.info("Scheduler loop started (Local Time)")
-        last_error_time = None
-        error_count = 0
-
-        while self.running:
-            try:
-                seconds_to_wait = self.seconds_until_target_time()
-                target_datetime = datetime.now() + timedelta(seconds=seconds_to_wait)
-
-                self.logger.info(f"Next summary scheduled for local time: {target_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-                self.logger.info(f"Waiting {seconds_to_wait} seconds...")
-
-                # 如果等待时间小于60秒，直接等待到目标时间
-                if seconds_to_wait <= 60:
-                    if seconds_to_wait > 0:
-                        threading.Event().wait(seconds_to_wait)
-
-                    if not self.running:
-                        self.logger.info("Scheduler stopped during wait, exiting")
-                        break
-
-                    # 执行总结任务
-                    local_now = datetime.now()
-                    self.logger.info(f"Executing daily summary task at local time: {local_now.strftime('%Y-%m-%d %H:%M:%S')}")
-                    self.logger.info(f"Scheduler running state: {self.running}")
+    def next_run_time(self, after: Optional[datetime] = None) -> datetime:
+        """计算 after（默认为当前本地时间）之后的下一个目标时间"""
+        after = after or datetime.now()
+        target_dt = datetime.combine(after.date(), self.target_time)
+        if after >= target_dt:
+            target_dt = target_dt + timedelta(days=1)
+        return target_dt
+
+    def _arm(self, next_run: datetime) -> None:
+        """
+        在事件循环上挂一个定时器，到达 next_run 时触发，等待期间不占用线程也不会被唤醒
+
+        等待时间只在这里按本地时间计算一次，之后换算为事件循环的单调时钟截止时间，
+        等待期间系统时间被调整（NTP校时等）不会导致提前触发或错过执行
+        """
+        self._next_run = next_run
+        delay = max(0.0, (next_run - datetime.now()).total_seconds())
+        self._deadline = self._loop.time() + delay
+        self.logger.info("Next summary scheduled for local time: %s", next_run)
+        self._handle = self._loop.call_at(self._deadline, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._handle = None
+        if not self.running:
+            return
 
-                    # 重置错误计数（成功执行后）
-                    error_count = 0
-                    last_error_time = None
+        # 定时器早于单调时钟截止时间触发时，继续等待剩余的时间
+        if self._loop.time() < self._deadline:
+            self._handle = self._loop.call_at(self._deadline, self._on_timer)
+            return
 
-                    try:
-                        # 在新的事件循环中运行
-                        self.logger.info("Creating new event loop for daily summaries")
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
+        self._task = self._loop.create_task(self._fire())
 
-                        # 运行并获取执行报告
-                        execution_report = loop.run_until_complete(self.send_daily_summaries())
+    async def _fire(self) -> None:
+        self.logger.info("Executing daily summary task")
 
-                        self.logger.info(f"Daily summary task completed, report: {execution_report}")
+        try:
+            # 运行并获取执行报告，和机器人共用同一个事件循环和连接池
+            execution_report = await self.send_daily_summaries()
 
-                        # 记录到调度器日志
-                        if execution_report['errors']:
-                            self.logger.warning(f"Daily summary completed with {len(execution_report['errors'])} errors/warnings")
-                        else:
-                            self.logger.info("Daily summary task completed successfully")
+            # 记录到调度器日志
+            if execution_report['errors']:
+                self.logger.warning("Daily summary completed with %d errors/warnings", len(execution_report['errors']))
+            else:
+                self.logger.info("Daily summary task completed successfully")
 
-                        loop.close()
+        except Exception as e:
+            self.logger.error("Error in summary task execution: %s", e)
 
-                    except Exception as e:
-                        error_count += 1
-                        last_error_time = datetime.now()
-                        self.logger.error(f"Error in summary task execution (error #{error_count}): {e}")
-
-                        # 如果连续错误超过3次，增加等待时间
-                        if error_count >= 3:
-                            self.logger.warning(f"Encountered {error_count} consecutive errors, waiting 10 minutes before retry")
-                            threading.Event().wait(600)
-
-                    # 执行完成后等待至少1分钟，避免立即重复执行
-                    self.logger.info("Waiting 60 seconds before scheduling next task")
-                    threading.Event().wait(60)
-                else:
-                    # 等待到目标时间前1分钟
-                    wait_time = seconds_to_wait - 60
-
-                    self.logger.info(f"Preparing for execution, will wait in {wait_time} second chunks")
-
-                    # 分段等待，每60秒检查一次是否仍在运行
-                    while wait_time > 0 and self.running:
-                        chunk = min(60, wait_time)
-                        threading.Event().wait(chunk)
-                        wait_time -= chunk
-
-                        # 定期检查点日志
-                        if wait_time % 600 == 0 and wait_time > 0:
-                            self.logger.info(f"Still waiting... {wait_time} seconds remaining until target time")
-
-            except Exception as e:
-                error_count += 1
-                last_error_time = datetime.now()
-                self.logger.error(f"Scheduler error (error #{error_count}): {e}")
-
-                # 如果连续错误超过5次，停止调度器
-                if error_count >= 5:
-                    self.logger.critical(f"Too many consecutive errors ({error_count}), stopping scheduler")
-                    self.running = False
-                    break
-
-                if self.running:
-                    # 出错后等待5分钟再重试
-                    self.logger.info("Waiting 5 minutes before retrying scheduler loop")
-                    threading.Event().wait(300)
+        finally:
+            self._task = None
+            # 从本次的目标时间往后计算下一次，避免执行时间很短时在同一分钟内重复执行
+            if self.running:
+                self._arm(self.next_run_time(max(datetime.now(), self._next_run)))
 
     def start(self):
+        """在当前运行中的事件循环上启动调度器，需要在协程中调用"""
         if self.running:
             self.logger.warning("Scheduler is already running")
             return
 
         self.running = True
-        self.scheduler_thread = threading.Thread(target=self.scheduler_loop, daemon=True)
-        self.scheduler_thread.start()
-        local_now = datetime.now()
-        self.logger.info(f"Daily summary scheduler started for {config.daily_summary_time} (Local Time)")
-        self.logger.info(f"Current local time: {local_now.strftime('%Y-%m-%d %H:%M:%S')}")
+        self._loop = asyncio.get_running_loop()
+        self._arm(self.next_run_time())
+        self.logger.info("Daily summary scheduler started for %s (Local Time)", config.daily_summary_time)
 
-    def stop(self):
+    def stop(self) -> Optional[asyncio.Task]:
+        """
+        停止调度器：取消定时器和正在执行的每日总结任务
+
+        Returns:
+            被取消的任务（没有正在执行的任务时为None），调用方应在关闭连接前等待其结束
+        """
         self.logger.info("Stopping scheduler...")
         self.running = False
-        if self.scheduler_thread and self.scheduler_thread.is_alive():
-            self.scheduler_thread.join(timeout=10)
+        handle, self._handle = self._handle, None
+        if handle is not None:
+            handle.cancel()
+        task = self._task
+        if task is not None and not task.done():
+            task.cancel()
         self.logger.info("Daily summary scheduler stopped")
-
+        return task
 
 __all__ = ['DailySummaryScheduler']
\ No newline at end of file
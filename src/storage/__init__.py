@@ -1,3 +1,15 @@
-from .message_storage import MessageStorage, get_local_time_with_offset, get_local_date_with_offset
+from .message_storage import (
+    MessageStorage,
+    get_local_time_with_offset,
+    get_local_date_with_offset,
+    parse_timestamp,
+    get_message_time
+)
 
-__all__ = ['MessageStorage', 'get_local_time_with_offset', 'get_local_date_with_offset']
\ No newline at end of file
+__all__ = [
+    'MessageStorage',
+    'get_local_time_with_offset',
+    'get_local_date_with_offset',
+    'parse_timestamp',
+    'get_message_time'
+]
\ No newline at end of file
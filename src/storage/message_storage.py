@@ -1,10 +1,41 @@
+import atexit
 import json
 import os
-from datetime import datetime, date, timedelta
-from typing import List, Dict, Any
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime, date, timedelta, timezone
+from functools import lru_cache
+from itertools import chain
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
 from ..config import config
+from .. import fastjson
+
+
+# Python 3.11+ 的 fromisoformat 直接支持 'Z' 后缀，无需先替换字符串
+_NATIVE_ISO_Z = sys.version_info >= (3, 11)
+
+# 消息写入缓冲：每个文件攒够这么多条时立即追加到文件，否则最晚这么多秒后由定时器写入
+_WRITE_BATCH_SIZE = 32
+_WRITE_BATCH_SECONDS = 5.0
+
+# 内存中最多缓存多少个（群组, 日期）的已解析消息
+_DAY_CACHE_SIZE = 64
+
+# 解析后的消息时间缓存在消息字典中的键名
+_PARSED_TIME_KEY = '_parsed_time'
+
+# 消息文件名（不含后缀）的日期格式 YYYY-MM-DD；ISO 日期字符串可直接按字典序比较
+_DATE_STEM_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+@lru_cache(maxsize=None)
+def _offset_timezone(offset_hours: float) -> timezone:
+    """偏移小时数对应的固定偏移时区，每个偏移量只创建一次"""
+    return timezone(timedelta(hours=offset_hours))
 
 
 def get_local_time_with_offset(utc_datetime: datetime = None) -> datetime:
@@ -17,14 +48,14 @@ def get_local_time_with_offset(utc_datetime: datetime = None) -> datetime:
     Returns:
         应用偏移量后的本地时间
     """
+    local_tz = _offset_timezone(config.timezone_offset_hours)
+
     if utc_datetime is None:
-        utc_datetime = datetime.utcnow()
+        # 直接取固定偏移时区的当前时间，返回不带时区的本地时间
+        return datetime.now(local_tz).replace(tzinfo=None)
 
     # 应用配置的偏移量
-    offset_hours = config.timezone_offset_hours
-    local_time = utc_datetime + timedelta(hours=offset_hours)
-
-    return local_time
+    return utc_datetime + local_tz.utcoffset(None)
 
 
 def get_local_date_with_offset(utc_datetime: datetime = None) -> date:
@@ -40,34 +71,99 @@ def get_local_date_with_offset(utc_datetime: datetime = None) -> date:
     return get_local_time_with_offset(utc_datetime).date()
 
 
+def parse_timestamp(timestamp: str) -> datetime:
+    """
+    解析ISO格式的消息时间戳
+
+    Args:
+        timestamp: ISO格式时间戳，可以带时区信息
+
+    Returns:
+        本地时间（不带时区），带时区的时间戳会先转换为本地时间
+    """
+    if not _NATIVE_ISO_Z and timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def get_message_time(message: Dict[str, Any]) -> Optional[datetime]:
+    """
+    获取消息的本地时间，解析结果缓存在消息字典中
+
+    同一批消息经过多次处理（分时段、格式化）时时间戳只解析一次
+
+    Returns:
+        消息时间，没有时间戳或无法解析时返回None
+    """
+    parsed = message.get(_PARSED_TIME_KEY)
+    if parsed is None:
+        timestamp = message.get('timestamp')
+        if not timestamp:
+            return None
+        try:
+            parsed = parse_timestamp(timestamp)
+        except (TypeError, ValueError):
+            return None
+        message[_PARSED_TIME_KEY] = parsed
+    return parsed
+
+
 class MessageStorage:
     def __init__(self):
         self.data_dir = Path(config.data_dir)
         self.data_dir.mkdir(exist_ok=True)
+        # save_message 会在线程池中执行，追加写入和旧格式文件的转换需要串行
+        self._write_lock = threading.Lock()
+        # 已确认存在的群组目录，避免每次取文件路径都调用mkdir
+        self._known_chat_dirs: Dict[int, Path] = {}
+        # get_chat_list 的缓存：(数据目录的修改时间, 群组列表)，新增群组目录时修改时间会变化
+        self._chat_list_cache: Optional[Tuple[int, List[int]]] = None
+        # 每个文件尚未写入的消息行，以及到期时写入所有缓冲的定时器（有缓冲的消息时才启动）
+        self._write_buffers: Dict[Path, List[bytes]] = {}
+        self._flush_timer: Optional[threading.Timer] = None
+        # 已解析的每天消息，按文件路径缓存（LRU），新消息直接追加到缓存的列表中
+        self._day_cache: 'OrderedDict[Path, List[Dict[str, Any]]]' = OrderedDict()
+        # 退出时写入缓冲中的消息
+        atexit.register(self.flush_all)
 
     def get_chat_dir(self, chat_id: int) -> Path:
-        chat_dir = self.data_dir / str(chat_id)
-        chat_dir.mkdir(exist_ok=True)
+        chat_dir = self._known_chat_dirs.get(chat_id)
+        if chat_dir is None:
+            chat_dir = self.data_dir / str(chat_id)
+            chat_dir.mkdir(exist_ok=True)
+            self._known_chat_dirs[chat_id] = chat_dir
         return chat_dir
 
     def get_today_file_path(self, chat_id: int) -> Path:
-        today = get_local_date_with_offset().strftime("%Y-%m-%d")
-        chat_dir = self.get_chat_dir(chat_id)
-        return chat_dir / f"{today}.json"
+        return self.get_file_path(chat_id, get_local_date_with_offset())
 
     def get_file_path(self, chat_id: int, target_date: date) -> Path:
-        date_str = target_date.strftime("%Y-%m-%d")
+        """每天一个JSONL文件，每行一条消息"""
+        date_str = target_date.isoformat()  # 与 strftime("%Y-%m-%d") 相同，但不需要解析格式串
         chat_dir = self.get_chat_dir(chat_id)
-        return chat_dir / f"{date_str}.json"
+        return chat_dir / f"{date_str}.jsonl"
+
+    def get_legacy_file_path(self, chat_id: int, target_date: date) -> Path:
+        """旧版本存储格式：每天一个JSON数组文件"""
+        return self.get_file_path(chat_id, target_date).with_suffix(".json")
 
     def save_message(self, chat_id: int, message: Dict[str, Any]) -> None:
-        file_path = self.get_today_file_path(chat_id)
+        with self._write_lock:
+            self._save_message(chat_id, message)
 
-        # 使用考虑偏移量的本地时间确定今天的日期
-        local_now = get_local_time_with_offset()
+    def _save_message(self, chat_id: int, message: Dict[str, Any]) -> None:
+        # 使用考虑偏移量的本地时间确定消息所属日期，有发送时间（UTC）时以发送时间为准
+        local_now = get_local_time_with_offset(message.get("date"))
         local_today = local_now.date()
 
-        messages = self.load_messages(chat_id, local_today)
+        file_path = self.get_file_path(chat_id, local_today)
+        if not file_path.exists():
+            # 当天还有旧格式的文件时先转换，之后都只追加
+            self._migrate_legacy_file(chat_id, local_today, file_path)
 
         # 构建存储的消息对象，只包含必要字段
         saved_msg = {
@@ -76,41 +172,135 @@ class MessageStorage:
             # 使用带偏移量的本地时间戳，精确到秒
             "timestamp": local_now.replace(microsecond=0).isoformat()
         }
-        messages.append(saved_msg)
 
+        # 先放入缓冲区，攒够一批时追加到文件，否则等定时器到期再写入
+        cached = self._day_cache.get(file_path)
+        if cached is not None:
+            cached.append(saved_msg)
+
+        buffer = self._write_buffers.setdefault(file_path, [])
+        buffer.append(fastjson.dumps(saved_msg) + b'\n')
+        if len(buffer) >= _WRITE_BATCH_SIZE:
+            self._flush_file(file_path)
+        elif self._flush_timer is None:
+            # 安静的群组里消息也不会长时间只留在内存中
+            timer = self._flush_timer = threading.Timer(_WRITE_BATCH_SECONDS, self.flush_all)
+            timer.daemon = True
+            timer.start()
+
+    def _flush_file(self, file_path: Path) -> None:
+        """把缓冲区中的消息一次追加到文件，调用方需持有写锁"""
+        lines = self._write_buffers.pop(file_path, None)
+        if not lines:
+            return
+
+        # 追加即可，不需要读取和重写当天已有的消息
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(messages, f, indent=2, ensure_ascii=False)
+            with open(file_path, 'ab') as f:
+                f.writelines(lines)
         except IOError as e:
             print(f"Error saving message: {e}")
 
+    def flush_all(self) -> None:
+        """写入所有缓冲中的消息，定时器到期和退出前调用"""
+        with self._write_lock:
+            timer, self._flush_timer = self._flush_timer, None
+            if timer is not None:
+                timer.cancel()
+            for file_path in list(self._write_buffers):
+                self._flush_file(file_path)
+
+    def _migrate_legacy_file(self, chat_id: int, target_date: date, file_path: Path) -> None:
+        legacy_path = self.get_legacy_file_path(chat_id, target_date)
+        if not legacy_path.exists():
+            return
+
+        messages = self._load_legacy_messages(legacy_path)
+        tmp_path = file_path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.writelines(fastjson.dumps(msg) + b'\n' for msg in messages)
+            os.replace(tmp_path, file_path)
+            legacy_path.unlink()
+        except IOError as e:
+            print(f"Error migrating messages file {legacy_path}: {e}")
+
     def load_messages(self, chat_id: int, target_date: date) -> List[Dict[str, Any]]:
         file_path = self.get_file_path(chat_id, target_date)
 
+        with self._write_lock:
+            # 读取前先写入这个文件还在缓冲区中的消息
+            if file_path in self._write_buffers:
+                self._flush_file(file_path)
+
+            messages = self._day_cache.get(file_path)
+            if messages is not None:
+                self._day_cache.move_to_end(file_path)
+            else:
+                messages = self._read_messages_file(chat_id, target_date, file_path)
+                if messages is None:
+                    return []
+                self._day_cache[file_path] = messages
+                if len(self._day_cache) > _DAY_CACHE_SIZE:
+                    self._day_cache.popitem(last=False)
+
+            # 返回副本，调用方修改列表不会影响缓存
+            return list(messages)
+
+    def _read_messages_file(self, chat_id: int, target_date: date,
+                            file_path: Path) -> Optional[List[Dict[str, Any]]]:
+        """从磁盘读取并解析一天的消息，读取失败时返回None"""
         if not file_path.exists():
+            legacy_path = self.get_legacy_file_path(chat_id, target_date)
+            if legacy_path.exists():
+                return self._load_legacy_messages(legacy_path)
             return []
 
+        # 一次读入整个文件再按行切分，避免逐行读取的缓冲开销
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        except IOError as e:
+            print(f"Error loading messages: {e}")
+            return None
+
+        messages = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                messages.append(fastjson.loads(line))
+            except json.JSONDecodeError as e:
+                # 写入中断留下的不完整行，跳过即可，不影响其他消息
+                print(f"Skipping malformed line in {file_path}: {e}")
+        return messages
+
+    @staticmethod
+    def _load_legacy_messages(file_path: Path) -> List[Dict[str, Any]]:
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(file_path, 'rb') as f:
+                return fastjson.loads(f.read())
         except (json.JSONDecodeError, IOError) as e:
             print(f"Error loading messages: {e}")
             return []
 
     def load_recent_messages(self, chat_id: int, hours: int = 24) -> List[Dict[str, Any]]:
         now = get_local_time_with_offset()
+        # 截止时间只计算一次，循环内直接比较时间
+        cutoff = now - timedelta(hours=hours)
+        # 存储的时间戳都是同一格式的本地时间ISO字符串，可以直接按字符串比较，不需要逐条解析
+        cutoff_iso = cutoff.isoformat()
         messages = []
 
         for day_offset in range(max(0, hours // 24 + 1)):
             target_date = (now.date() - timedelta(days=day_offset))
             day_messages = self.load_messages(chat_id, target_date)
 
-            for msg in day_messages:
-                msg_time = datetime.fromisoformat(msg['timestamp'])
-                time_diff = (now - msg_time).total_seconds()
-
-                if time_diff <= hours * 3600:
-                    messages.append(msg)
+            if datetime.combine(target_date, datetime.min.time()) >= cutoff:
+                # 整天都在时间范围内，不需要逐条比较
+                messages.extend(day_messages)
+            else:
+                messages.extend(msg for msg in day_messages if msg['timestamp'] >= cutoff_iso)
 
         messages.sort(key=lambda x: x['timestamp'])
         return messages
@@ -119,47 +309,97 @@ class MessageStorage:
         return len(self.load_recent_messages(chat_id, hours))
 
     def get_latest_messages(self, chat_id: int, count: int = 100) -> List[Dict[str, Any]]:
+        return self.get_messages_since(chat_id, None, count)
+
+    def get_messages_since(self, chat_id: int, since: Optional[datetime] = None,
+                           limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        获取指定时间之后的最新消息
+
+        Args:
+            chat_id: 群组ID
+            since: 本地时间（带偏移量），为None时不限制时间（最多回溯30天）
+            limit: 最多返回的消息数
+
+        Returns:
+            按时间从新到旧排序的消息列表
+        """
         messages = []
-        now = get_local_time_with_offset()
+        today = get_local_time_with_offset().date()
+        # 最早需要读取的日期，不限制时间时最多回溯30天
+        first_date = since.date() if since is not None else today - timedelta(days=29)
+        since_iso = since.isoformat() if since is not None else None
+
+        # 只读取实际存在的日期文件，从新到旧，够数后立即停止
+        for day in self.list_message_dates(chat_id):
+            if day > today:
+                continue
+            if day < first_date:
+                break
 
-        for day_offset in range(30):
-            target_date = (now.date() - timedelta(days=day_offset))
-            day_messages = self.load_messages(chat_id, target_date)
+            day_messages = self.load_messages(chat_id, day)
+            if since is not None and datetime.combine(day, datetime.min.time()) < since:
+                # 与 load_recent_messages 相同，直接比较ISO时间戳字符串
+                day_messages = [msg for msg in day_messages if msg['timestamp'] >= since_iso]
             messages.extend(day_messages)
 
-            if len(messages) >= count:
+            if len(messages) >= limit:
                 break
 
         messages.sort(key=lambda x: x['timestamp'], reverse=True)
-        return messages[:count]
+        return messages[:limit]
+
+    def list_message_dates(self, chat_id: int) -> List[date]:
+        """列出群组有消息文件的日期（包括旧格式文件），从新到旧排序"""
+        dates = set()
+        with os.scandir(self.get_chat_dir(chat_id)) as entries:
+            for entry in entries:
+                stem, dot, suffix = entry.name.partition('.')
+                if suffix not in ("jsonl", "json"):
+                    continue
+                try:
+                    dates.add(datetime.strptime(stem, "%Y-%m-%d").date())
+                except ValueError:
+                    continue
+        return sorted(dates, reverse=True)
 
     def delete_old_messages(self, chat_id: int, days_to_keep: int = 30) -> None:
         chat_dir = self.get_chat_dir(chat_id)
-        cutoff_date = get_local_date_with_offset() - timedelta(days=days_to_keep)
-
-        for file_path in chat_dir.glob("*.json"):
-            try:
-                file_date_str = file_path.stem
-                file_date = datetime.strptime(file_date_str, "%Y-%m-%d").date()
+        cutoff_str = (get_local_date_with_offset() - timedelta(days=days_to_keep)).isoformat()
 
-                if file_date < cutoff_date:
-                    file_path.unlink()
-                    print(f"Deleted old messages file: {file_path}")
-            except ValueError:
+        # 同时清理旧格式的 .json 文件
+        for file_path in chain(chat_dir.glob("*.jsonl"), chat_dir.glob("*.json")):
+            file_date_str = file_path.stem
+            if not _DATE_STEM_RE.match(file_date_str):
                 continue
 
+            if file_date_str < cutoff_str:
+                file_path.unlink()
+                with self._write_lock:
+                    self._day_cache.pop(file_path.with_suffix('.jsonl'), None)
+                print(f"Deleted old messages file: {file_path}")
+
     def get_chat_list(self) -> List[int]:
+        # 数据目录没有变化时直接返回上次扫描的结果
+        mtime = self.data_dir.stat().st_mtime_ns
+        cached = self._chat_list_cache
+        if cached is not None and cached[0] == mtime:
+            return list(cached[1])
+
         chat_ids = []
-        for item in self.data_dir.iterdir():
-            if item.is_dir():
-                # 支持负数群组ID（如 -1003128718593）
-                try:
-                    chat_id = int(item.name)
-                    chat_ids.append(chat_id)
-                except ValueError:
-                    # 忽略非数字目录名
-                    continue
-        return chat_ids
+        # scandir 返回的条目自带文件类型，判断是否为目录不需要再调用stat
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # 支持负数群组ID（如 -1003128718593）
+                    try:
+                        chat_id = int(entry.name)
+                        chat_ids.append(chat_id)
+                    except ValueError:
+                        # 忽略非数字目录名
+                        continue
+        self._chat_list_cache = (mtime, chat_ids)
+        return list(chat_ids)
 
     def get_daily_stats(self, chat_id: int, target_date: date) -> Dict[str, Any]:
         messages = self.load_messages(chat_id, target_date)
@@ -172,17 +412,12 @@ class MessageStorage:
                 "users": []
             }
 
-        user_counts = {}
-        for msg in messages:
-            user = msg.get('user', 'Unknown')
-            user_counts[user] = user_counts.get(user, 0) + 1
+        # Counter在C层完成计数，most_common 直接返回按消息数从多到少排序的列表
+        user_counts = Counter(msg.get('user', 'Unknown') for msg in messages)
 
         return {
             "date": target_date.isoformat(),
             "message_count": len(messages),
             "user_count": len(user_counts),
-            "users": sorted(user_counts.items(), key=lambda x: x[1], reverse=True)
+            "users": user_counts.most_common()
         }
-
-
-from datetime import timedelta
\ No newline at end of file
@@ -4,6 +4,7 @@
 用于测试整个每日总结功能的工作流程
 """
 
+import asyncio
 import sys
 import os
 from datetime import datetime, timedelta
@@ -48,7 +49,7 @@ def test_full_daily_summary_flow():
         mock_api.return_value = "**测试话题**\n- 时间：09:00-09:10\n- 群成员：用户A, 用户B, 用户C\n- 总结：用户们在讨论早上的天气和出行建议\n- 高热发言：用户A说'大家早上好！今天天气不错'"
 
         ai_summary = AISummary()
-        result = ai_summary.generate_period_summary(test_messages, "早晨")
+        result = asyncio.run(ai_summary.generate_period_summary(test_messages, "早晨"))
 
         if result and not result.startswith("错误"):
             print("PASS: AI总结功能测试通过")
@@ -69,8 +70,8 @@ def test_full_daily_summary_flow():
         {"timestamp": "2023-01-01T14:30:00"},
     ]
 
-    filtered = bot._filter_messages_by_time_range(messages, "08:00", "12:00")
-    if len(filtered) == 2:
+    buckets = bot._group_messages_by_period(messages, (("上午", "08:00", "12:00"),))
+    if len(buckets["上午"]) == 2:
         print("PASS: 消息时间过滤功能测试通过")
     else:
         print("FAIL: 消息时间过滤功能测试失败")
@@ -105,7 +106,7 @@ def test_error_handling():
         mock_api.return_value = "错误：API密钥无效"
 
         ai_summary = AISummary()
-        result = ai_summary.generate_period_summary([{"user": "test", "text": "test", "timestamp": "2023-01-01T08:30:00"}], "早晨")
+        result = asyncio.run(ai_summary.generate_period_summary([{"user": "test", "text": "test", "timestamp": "2023-01-01T08:30:00"}], "早晨"))
 
         if result and result.startswith("错误"):
             print("PASS: API错误处理测试通过")
@@ -120,7 +121,7 @@ def test_error_handling():
         mock_api.side_effect = Exception("网络连接超时")
 
         ai_summary = AISummary()
-        result = ai_summary.generate_period_summary([{"user": "test", "text": "test", "timestamp": "2023-01-01T08:30:00"}], "早晨")
+        result = asyncio.run(ai_summary.generate_period_summary([{"user": "test", "text": "test", "timestamp": "2023-01-01T08:30:00"}], "早晨"))
 
         if result and "异常" in result:
             print("PASS: 异常处理测试通过")
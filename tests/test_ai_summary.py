@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, Mock, patch
+
+import httpx
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ai.batch import BatchDispatcher, BatchRequestError
+from src.ai.summary import AISummary
+
+
+class TestAISummaryCache(unittest.TestCase):
+    def setUp(self):
+        """使用临时目录保存缓存文件"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ai_summary = AISummary()
+        self.ai_summary.api_key = "test-key"
+        self.ai_summary.cache_enabled = True
+        self.ai_summary._cache_path = Path(self.temp_dir.name) / "ai_cache.json"
+
+        response = Mock(status_code=200)
+        response.content = '{"choices": [{"message": {"content": "缓存测试总结"}}]}'.encode('utf-8')
+        self.client = Mock()
+        self.client.post = AsyncMock(return_value=response)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _run_requests(self, ai_summary, *message_lists):
+        """在同一个事件循环中依次发送请求，最后等待缓存文件写入完成"""
+        async def run():
+            results = [await ai_summary._make_api_request(messages) for messages in message_lists]
+            await ai_summary.close()
+            return results
+
+        with patch.object(AISummary, '_ensure_client', AsyncMock(return_value=self.client)):
+            return asyncio.run(run())
+
+    def test_identical_request_hits_cache(self):
+        """相同的请求内容只调用一次API，缓存写入文件后新实例也能命中"""
+        messages = [{"role": "user", "content": "你好"}]
+
+        first, second = self._run_requests(self.ai_summary, messages, messages)
+
+        self.assertEqual(first, "缓存测试总结")
+        self.assertEqual(second, "缓存测试总结")
+        self.assertEqual(self.client.post.await_count, 1)
+        self.assertTrue(self.ai_summary._cache_path.exists())
+
+        restarted = AISummary()
+        restarted.api_key = "test-key"
+        restarted.cache_enabled = True
+        restarted._cache_path = self.ai_summary._cache_path
+        self.assertEqual(self._run_requests(restarted, messages), ["缓存测试总结"])
+        self.assertEqual(self.client.post.await_count, 1)
+
+    def test_different_request_misses_cache(self):
+        """对话内容不同时不命中缓存"""
+        self._run_requests(self.ai_summary, [{"role": "user", "content": "你好"}], [{"role": "user", "content": "再见"}])
+
+        self.assertEqual(self.client.post.await_count, 2)
+
+    def test_expired_entry_is_requested_again(self):
+        """缓存条目过期后重新请求API"""
+        messages = [{"role": "user", "content": "你好"}]
+        self.ai_summary.cache_ttl = 60
+
+        with patch('src.ai.summary.time.time', return_value=1000.0):
+            self._run_requests(self.ai_summary, messages, messages)
+        self.assertEqual(self.client.post.await_count, 1)
+
+        with patch('src.ai.summary.time.time', return_value=1061.0):
+            self._run_requests(self.ai_summary, messages)
+        self.assertEqual(self.client.post.await_count, 2)
+
+    def test_cache_can_be_bypassed(self):
+        """use_cache=False 时总是请求API"""
+        messages = [{"role": "user", "content": "你好"}]
+
+        with patch.object(AISummary, '_ensure_client', AsyncMock(return_value=self.client)):
+            asyncio.run(self.ai_summary._make_api_request(messages, use_cache=False))
+            asyncio.run(self.ai_summary._make_api_request(messages, use_cache=False))
+
+        self.assertEqual(self.client.post.await_count, 2)
+
+
+class TestAISummaryStreaming(unittest.TestCase):
+    def test_stream_forwards_partial_content(self):
+        """流式请求会推送中间结果并返回完整内容"""
+        sse_body = (
+            'data: {"choices": [{"delta": {"content": "热聊"}}]}\n\n'
+            'data: {"choices": [{"delta": {"content": "话题"}}]}\n\n'
+            'data: [DONE]\n\n'
+        )
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, text=sse_body))
+        ai_summary = AISummary()
+        ai_summary.api_key = "test-key"
+        ai_summary.cache_enabled = False
+        partials = []
+
+        async def on_partial(text):
+            partials.append(text)
+
+        async def run():
+            async with httpx.AsyncClient(transport=transport, base_url="https://example.com/v1") as client:
+                with patch.object(AISummary, '_ensure_client', AsyncMock(return_value=client)):
+                    return await ai_summary._make_api_request([{"role": "user", "content": "你好"}], on_partial=on_partial)
+
+        with patch('src.ai.summary._STREAM_UPDATE_INTERVAL', 0):
+            result = asyncio.run(run())
+
+        self.assertEqual(result, "热聊话题")
+        self.assertEqual(partials, ["热聊", "热聊话题"])
+
+    def _stream_request(self, body):
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, text=body))
+        ai_summary = AISummary()
+        ai_summary.api_key = "test-key"
+        ai_summary.cache_enabled = False
+        on_partial = AsyncMock()
+
+        async def run():
+            async with httpx.AsyncClient(transport=transport, base_url="https://example.com/v1") as client:
+                with patch.object(AISummary, '_ensure_client', AsyncMock(return_value=client)):
+                    return await ai_summary._make_api_request([{"role": "user", "content": "你好"}], on_partial=on_partial)
+
+        return asyncio.run(run())
+
+    def test_stream_falls_back_to_plain_json_response(self):
+        """接口忽略 stream 参数返回普通JSON时按非流式响应解析"""
+        body = '{\n  "choices": [{"message": {"content": "普通响应"}}]\n}'
+
+        self.assertEqual(self._stream_request(body), "普通响应")
+
+    def test_stream_skips_malformed_chunk(self):
+        """损坏的流式事件被跳过，其余内容正常返回"""
+        body = (
+            'data: {"choices": [{"delta": {"content": "热聊"}}]}\n\n'
+            'data: {"choices": [\n\n'
+            'data: {"choices": [{"delta": {"content": "话题"}}]}\n\n'
+            'data: [DONE]\n\n'
+        )
+
+        self.assertEqual(self._stream_request(body), "热聊话题")
+
+
+class TestBatchDispatcher(unittest.TestCase):
+    def _response(self, json_data=None, text=""):
+        response = Mock(text=text)
+        response.json.return_value = json_data
+        return response
+
+    def test_requests_in_window_share_one_batch(self):
+        """窗口期内提交的请求合并为一个Batch任务"""
+        output = "\n".join([
+            '{"custom_id": "request-1", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": "总结1"}}]}}}',
+            '{"custom_id": "request-2", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": "总结2"}}]}}}',
+        ])
+        client = Mock()
+        client.post = AsyncMock(side_effect=[
+            self._response({"id": "file-1"}),
+            self._response({"id": "batch-1", "status": "in_progress"}),
+        ])
+        client.get = AsyncMock(side_effect=[
+            self._response({"id": "batch-1", "status": "completed", "output_file_id": "file-2"}),
+            self._response(text=output),
+        ])
+
+        async def run():
+            dispatcher = BatchDispatcher(AsyncMock(return_value=client), window_seconds=0, poll_interval=0,
+                                         endpoint="/openai/v1/chat/completions")
+            return await asyncio.gather(dispatcher.submit({"n": 1}), dispatcher.submit({"n": 2}))
+
+        self.assertEqual(asyncio.run(run()), ["总结1", "总结2"])
+        # 上传文件 + 创建任务
+        self.assertEqual(client.post.await_count, 2)
+
+        # 每行请求和任务都使用配置的接口路径
+        upload_call, create_call = client.post.await_args_list
+        lines = upload_call.kwargs["files"]["file"][1].splitlines()
+        self.assertEqual([json.loads(line)["url"] for line in lines], ["/openai/v1/chat/completions"] * 2)
+        self.assertEqual(create_call.kwargs["json"]["endpoint"], "/openai/v1/chat/completions")
+
+    def test_endpoint_follows_api_base_path(self):
+        """Batch接口路径由API地址推导，不假定总是 /v1"""
+        ai_summary = AISummary()
+        ai_summary.api_base = "https://example.com/openai/v1"
+
+        async def run():
+            return ai_summary._get_batch_dispatcher().endpoint
+
+        self.assertEqual(asyncio.run(run()), "/openai/v1/chat/completions")
+
+    def test_failed_batch_raises_for_every_request(self):
+        """Batch任务失败时每个请求都会收到异常，方便调用方退回普通请求"""
+        client = Mock()
+        client.post = AsyncMock(side_effect=[
+            self._response({"id": "file-1"}),
+            self._response({"id": "batch-1", "status": "failed"}),
+        ])
+
+        async def run():
+            dispatcher = BatchDispatcher(AsyncMock(return_value=client), window_seconds=0, poll_interval=0)
+            return await asyncio.gather(dispatcher.submit({"n": 1}), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertIsInstance(results[0], BatchRequestError)
+
+
+if __name__ == '__main__':
+    unittest.main()
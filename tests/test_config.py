@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import Config
+
+
+class TestConfigAllowedChats(unittest.TestCase):
+    def setUp(self):
+        """使用临时目录中的配置文件"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.config_path = Path(self.temp_dir.name) / "config.json"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_string_chat_ids_are_coerced(self):
+        """字符串形式的群组ID转换为int，无效的ID被跳过并记录警告"""
+        self.config_path.write_text(
+            '{"telegram": {"allowed_chats": ["-100123", 456, "abc", null]}}', encoding='utf-8'
+        )
+
+        with self.assertLogs('src.config', level='WARNING') as logs:
+            config = Config(str(self.config_path))
+
+        self.assertEqual(config.allowed_chats, frozenset({-100123, 456}))
+        self.assertEqual(len(logs.output), 2)
+
+    def test_set_rebuilds_allowed_chats(self):
+        """通过 set() 修改允许的群组时同样转换为int"""
+        config = Config(str(self.config_path))
+        self.assertEqual(config.allowed_chats, frozenset())
+
+        config.set("telegram.allowed_chats", ["-100789", 42])
+
+        self.assertEqual(config.allowed_chats, frozenset({-100789, 42}))
+        self.assertIn(-100789, config.allowed_chats)
+
+
+if __name__ == '__main__':
+    unittest.main()
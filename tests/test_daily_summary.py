@@ -1,13 +1,22 @@
+import asyncio
+import json
+import tempfile
 import unittest
 import os
 import sys
+from collections import Counter
 from datetime import datetime, date, timedelta
-from unittest.mock import Mock, patch
+from pathlib import Path
+from unittest.mock import AsyncMock, Mock, patch
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.bot.telegram_bot import TelegramBot
+from telegram.helpers import escape_markdown
+
+from src.bot.telegram_bot import (
+    TelegramBot, _TIME_PERIODS, _iter_text_chunks, _to_markdown_v2, _escape_markdown_v2, _escape_markdown_v2_code
+)
 from src.storage.message_storage import MessageStorage
 from src.ai.summary import AISummary
 
@@ -31,7 +40,7 @@ class TestDailySummary(unittest.TestCase):
         ]
 
     def test_filter_messages_by_time_range(self):
-        """测试消息时间范围过滤功能"""
+        """测试消息时间范围过滤功能（与每日总结使用相同的时段分组方法）"""
         bot = TelegramBot()
 
         # 测试正常时间范围
@@ -41,7 +50,7 @@ class TestDailySummary(unittest.TestCase):
             {"timestamp": "2023-01-01T14:30:00"},
         ]
 
-        filtered = bot._filter_messages_by_time_range(messages, "08:00", "12:00")
+        filtered = bot._group_messages_by_period(messages, (("上午", "08:00", "12:00"),))["上午"]
         self.assertEqual(len(filtered), 2)
 
         # 测试跨日时间范围
@@ -51,25 +60,64 @@ class TestDailySummary(unittest.TestCase):
             {"timestamp": "2023-01-01T14:30:00"},
         ]
 
-        filtered = bot._filter_messages_by_time_range(messages, "22:00", "06:00")
+        filtered = bot._group_messages_by_period(messages, (("夜间", "22:00", "06:00"),))["夜间"]
         self.assertEqual(len(filtered), 2)
 
+    def test_group_messages_by_period(self):
+        """测试单次遍历的时段分组功能"""
+        bot = TelegramBot()
+        messages = [
+            {"user": "A", "timestamp": "2023-01-01T01:30:00"},
+            {"user": "B", "timestamp": "2023-01-01T06:00:00"},
+            {"user": "A", "timestamp": "2023-01-01T14:30:00"},
+            {"user": "A", "timestamp": "2023-01-01T23:59:30"},
+            {"user": "B", "timestamp": ""},
+        ]
+
+        user_stats = Counter()
+        buckets = bot._group_messages_by_period(messages, _TIME_PERIODS, user_stats)
+
+        # 边界时间只归入一个时段，23:59之后的消息归入最后一个时段
+        self.assertEqual(len(buckets["深夜"]), 1)
+        self.assertEqual(len(buckets["早晨"]), 1)
+        self.assertEqual(len(buckets["下午"]), 1)
+        self.assertEqual(len(buckets["晚上"]), 1)
+        # 用户统计包含所有消息，包括无法解析时间的消息
+        self.assertEqual(user_stats, {"A": 3, "B": 2})
+
+    def test_group_messages_by_period_minute_boundaries(self):
+        """测试自定义时段按分钟划分，支持非整点和跨日时段"""
+        bot = TelegramBot()
+        messages = [
+            {"timestamp": "2023-01-01T08:15:00"},
+            {"timestamp": "2023-01-01T08:30:00"},
+            {"timestamp": "2023-01-01T23:30:00"},
+            {"timestamp": "2023-01-01T05:59:00"},
+            {"timestamp": "2023-01-01T06:00:00"},
+        ]
+
+        buckets = bot._group_messages_by_period(messages, (("上午", "08:30", "12:00"), ("夜间", "22:00", "06:00")))
+
+        self.assertEqual([msg["timestamp"][11:16] for msg in buckets["上午"]], ["08:30"])
+        # 跨日时段包含开始时间，不包含结束时间
+        self.assertEqual([msg["timestamp"][11:16] for msg in buckets["夜间"]], ["23:30", "05:59"])
+
     @patch('src.ai.summary.AISummary._make_api_request')
     def test_generate_period_summary_success(self, mock_api_request):
         """测试生成时段总结成功的情况"""
         mock_api_request.return_value = "测试总结内容"
 
         ai_summary = AISummary()
-        result = ai_summary.generate_period_summary(self.test_messages, "早晨")
+        result = asyncio.run(ai_summary.generate_period_summary(self.test_messages, "早晨"))
 
         self.assertEqual(result, "测试总结内容")
-        mock_api_request.assert_called_once()
+        mock_api_request.assert_awaited_once()
 
     @patch('src.ai.summary.AISummary._make_api_request')
     def test_generate_period_summary_empty_messages(self, mock_api_request):
         """测试生成时段总结时没有消息的情况"""
         ai_summary = AISummary()
-        result = ai_summary.generate_period_summary([], "早晨")
+        result = asyncio.run(ai_summary.generate_period_summary([], "早晨"))
 
         self.assertEqual(result, "没有消息可以总结")
         mock_api_request.assert_not_called()
@@ -80,7 +128,7 @@ class TestDailySummary(unittest.TestCase):
         mock_api_request.return_value = "错误：API请求失败"
 
         ai_summary = AISummary()
-        result = ai_summary.generate_period_summary(self.test_messages, "早晨")
+        result = asyncio.run(ai_summary.generate_period_summary(self.test_messages, "早晨"))
 
         self.assertEqual(result, "错误：API请求失败")
 
@@ -90,10 +138,186 @@ class TestDailySummary(unittest.TestCase):
         mock_api_request.side_effect = Exception("测试异常")
 
         ai_summary = AISummary()
-        result = ai_summary.generate_period_summary(self.test_messages, "早晨")
+        result = asyncio.run(ai_summary.generate_period_summary(self.test_messages, "早晨"))
 
         self.assertTrue(result.startswith("错误：生成早晨时段总结时发生异常"))
 
+    def test_concurrent_summary_commands_share_one_ai_call(self):
+        """测试同一群组同时发出的两个 /summary 只调用一次AI"""
+        bot = TelegramBot()
+        bot.application = Mock()
+        bot.setup_handlers()
+        handlers = [call.args[0] for call in bot.application.add_handler.call_args_list]
+        summary_handler = next(h for h in handlers if "summary" in getattr(h, "commands", ()))
+        # 处理器不阻塞，PTB才会在第一个总结生成期间处理第二个命令
+        self.assertFalse(summary_handler.block)
+
+        def make_update():
+            update = Mock()
+            update.effective_chat.id = self.test_chat_id
+            update.effective_chat.type = 'private'
+            update.message.reply_text = AsyncMock(return_value=Mock(message_id=1))
+            return update
+
+        async def run():
+            release = asyncio.Event()
+
+            async def generate(*args, **kwargs):
+                await release.wait()
+                return "合并的总结"
+
+            bot.ai_summary.generate_manual_summary = AsyncMock(side_effect=generate)
+            bot.split_and_send = AsyncMock()
+            bot.delete_message_safely = AsyncMock()
+            with patch.object(bot.storage, 'get_messages_since', return_value=self.test_messages):
+                first = asyncio.create_task(bot.summary_command(make_update(), Mock()))
+                second = asyncio.create_task(bot.summary_command(make_update(), Mock()))
+                await asyncio.sleep(0.05)
+                release.set()
+                await asyncio.gather(first, second)
+
+            bot.ai_summary.generate_manual_summary.assert_awaited_once()
+            self.assertEqual(bot.split_and_send.await_count, 2)
+            self.assertEqual(bot._inflight_summaries, {})
+
+        asyncio.run(run())
+
+    def test_start_cleans_up_and_saves_offset_when_stopped(self):
+        """测试 stop() 唤醒 start() 后在事件循环中完成清理并保存update_id"""
+        bot = TelegramBot()
+        bot.bot_token = "test-token"
+        bot.ai_summary.close = AsyncMock()
+
+        application = Mock()
+        for name in ("initialize", "start", "stop", "shutdown"):
+            setattr(application, name, AsyncMock())
+        application.updater.start_polling = AsyncMock()
+        application.updater.stop = AsyncMock()
+        builder = Mock()
+        builder.token.return_value = builder.request.return_value = builder.get_updates_request.return_value = builder
+        builder.build.return_value = application
+
+        async def run():
+            task = asyncio.create_task(bot.start())
+            while not application.updater.start_polling.await_count:
+                await asyncio.sleep(0.01)
+            bot._last_update_id = 42
+            bot.stop()
+            await asyncio.wait_for(task, 1)
+
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                patch('src.bot.telegram_bot.Application.builder', return_value=builder), \
+                patch('src.bot.telegram_bot.config') as mock_config:
+            mock_config.daily_summary_enabled = False
+            bot._offset_path = Path(temp_dir) / "telegram_offset.json"
+            asyncio.run(run())
+
+            self.assertEqual(json.loads(bot._offset_path.read_text(encoding='utf-8')), {"offset": 42})
+
+        application.updater.stop.assert_awaited_once()
+        application.stop.assert_awaited_once()
+        application.shutdown.assert_awaited_once()
+        bot.ai_summary.close.assert_awaited_once()
+
+    def test_update_status_message_is_best_effort(self):
+        """测试编辑状态消息遇到限流或网络错误时不抛出异常"""
+        from telegram.error import NetworkError, RetryAfter
+
+        bot = TelegramBot()
+        bot.application = Mock()
+        bot.safe_send_message = AsyncMock()
+
+        for error in (RetryAfter(3), NetworkError("连接中断")):
+            bot.application.bot.edit_message_text = AsyncMock(side_effect=error)
+            asyncio.run(bot.update_status_message(self.test_chat_id, 1, "进度"))
+
+        bot.safe_send_message.assert_not_called()
+
+    def test_safe_send_and_split_measures_escaped_length(self):
+        """测试按转换为MarkdownV2之后的长度切分，转义后不会超过Telegram的长度上限"""
+        bot = TelegramBot()
+        bot.safe_send_message = AsyncMock(return_value=Mock())
+        # 原文不到4000字符，但每个 . 和 - 转义后都会多一个反斜杠
+        text = "\n".join(["a.b-c." * 20] * 30)
+        long_line = "." * 3000
+        self.assertLess(len(text), 4000)
+        self.assertGreater(len(_to_markdown_v2(text)), 4096)
+
+        asyncio.run(bot.safe_send_and_split(self.test_chat_id, text))
+        self.assertEqual(bot.safe_send_message.await_count, 2)
+        asyncio.run(bot.safe_send_and_split(self.test_chat_id, long_line))
+
+        parts = [call.args[1] for call in bot.safe_send_message.await_args_list]
+        self.assertEqual("".join(parts[2:]), long_line)
+        for part in parts:
+            self.assertLessEqual(len(_to_markdown_v2(part)), 4096)
+
+    def test_safe_send_message_gives_up_after_repeated_rate_limits(self):
+        """测试持续被限流时只重试有限次数"""
+        from telegram.error import RetryAfter
+
+        bot = TelegramBot()
+        bot._send_text = AsyncMock(side_effect=RetryAfter(0))
+
+        result = asyncio.run(bot.safe_send_message(self.test_chat_id, "消息"))
+
+        self.assertIsNone(result)
+        self.assertEqual(bot._send_text.await_count, 3)
+
+    def test_iter_text_chunks_splits_on_newlines(self):
+        """测试长文本在换行处切分"""
+        text = "a" * 6 + "\n\n" + "b" * 6 + "\n" + "c" * 12
+        chunks = list(_iter_text_chunks(text, 10))
+
+        self.assertEqual(chunks, ["a" * 6, "b" * 6, "c" * 10, "c" * 2])
+        self.assertEqual(list(_iter_text_chunks("short", 10)), ["short"])
+
+    def test_to_markdown_v2(self):
+        """测试常规Markdown转换为MarkdownV2"""
+        text = "**总结** 第1条 *重点* `a_b` 1+1=2! 未闭合的*号"
+        expected = "*总结* 第1条 _重点_ `a_b` 1\\+1\\=2\\! 未闭合的\\*号"
+
+        self.assertEqual(_to_markdown_v2(text), expected)
+
+        # 普通文本和代码的转义规则与 python-telegram-bot 自带的 escape_markdown 一致
+        plain = r"a_b*c[d](e)~f`g>h#i+j-k=l|m{n}o.p!q\r"
+        self.assertEqual(_escape_markdown_v2(plain), escape_markdown(plain, version=2))
+        self.assertEqual(_escape_markdown_v2_code(plain), escape_markdown(plain, version=2, entity_type="code"))
+
+    def test_remove_all_markdown(self):
+        """测试移除所有Markdown标记"""
+        bot = TelegramBot()
+        text = "# 标题\n* **粗体 `代码`** 和 *斜体*\n- [链接](https://example.com) ~~删除~~ __下划线__\n```\ncode\n```"
+
+        self.assertEqual(bot.remove_all_markdown(text), "标题\n粗体 代码 和 斜体\n链接 删除 下划线")
+        self.assertEqual(bot.remove_all_markdown("  没有任何标记的消息\n"), "没有任何标记的消息")
+
+    def test_scheduler_stop_cancels_running_summary(self):
+        """测试停止调度器时取消正在执行的每日总结任务并返回给调用方等待"""
+        from src.scheduler import DailySummaryScheduler
+        scheduler = DailySummaryScheduler(Mock())
+
+        async def run():
+            started = asyncio.Event()
+
+            async def never_finishes(_self):
+                started.set()
+                await asyncio.Event().wait()
+
+            with patch.object(DailySummaryScheduler, 'send_daily_summaries', never_finishes):
+                scheduler.start()
+                scheduler._task = asyncio.create_task(scheduler._fire())
+                await started.wait()
+                task = scheduler.stop()
+                await asyncio.gather(task, return_exceptions=True)
+            return task
+
+        task = asyncio.run(run())
+
+        self.assertTrue(task.cancelled())
+        self.assertIsNone(scheduler._handle)
+        self.assertIsNone(scheduler._task)
+
     def test_scheduler_seconds_until_target_time(self):
         """测试计算到目标时间的秒数"""
         from src.scheduler import DailySummaryScheduler
@@ -105,6 +329,79 @@ class TestDailySummary(unittest.TestCase):
         self.assertGreater(seconds, 0)
         self.assertLess(seconds, 7200)  # 应该小于2小时
 
+    def test_storage_appends_jsonl_and_reads_legacy_json(self):
+        """测试消息追加写入JSONL文件，并兼容旧版JSON数组文件"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = MessageStorage()
+            storage.data_dir = Path(temp_dir)
+            day = date(2024, 1, 2)
+            sent_at = datetime(2024, 1, 2, 9, 30)
+
+            # 旧格式文件可以直接读取
+            legacy_path = storage.get_legacy_file_path(self.test_chat_id, day)
+            legacy_path.write_text(json.dumps(self.test_messages[:1], ensure_ascii=False), encoding='utf-8')
+            self.assertEqual(storage.load_messages(self.test_chat_id, day), self.test_messages[:1])
+
+            # 写入新消息时旧文件被转换为JSONL，之后只追加
+            with patch('src.storage.message_storage.config') as mock_config:
+                mock_config.timezone_offset_hours = 0
+                storage.save_message(self.test_chat_id, {"user": "测试用户2", "text": "追加", "date": sent_at})
+                storage.save_message(self.test_chat_id, {"user": "测试用户3", "text": "再追加", "date": sent_at})
+
+            self.assertFalse(legacy_path.exists())
+
+            # 读取时会先写入缓冲中的消息
+            messages = storage.load_messages(self.test_chat_id, day)
+            lines = storage.get_file_path(self.test_chat_id, day).read_text(encoding='utf-8').splitlines()
+            self.assertEqual(len(lines), 3)
+            self.assertEqual([msg["user"] for msg in messages], ["测试用户1", "测试用户2", "测试用户3"])
+            self.assertEqual(messages[2]["timestamp"], "2024-01-02T09:30:00")
+
+    def test_storage_flushes_buffered_messages_after_deadline(self):
+        """测试缓冲中的消息不等下一条消息，到期后由定时器写入文件"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = MessageStorage()
+            storage.data_dir = Path(temp_dir)
+            day = date(2024, 1, 2)
+
+            with patch('src.storage.message_storage.config') as mock_config, \
+                    patch('src.storage.message_storage._WRITE_BATCH_SECONDS', 0.05):
+                mock_config.timezone_offset_hours = 0
+                storage.save_message(self.test_chat_id, {"user": "测试用户1", "text": "第一条", "date": datetime(2024, 1, 2, 9, 0)})
+
+            timer = storage._flush_timer
+            self.assertIsNotNone(timer)
+            timer.join(1)
+
+            file_path = storage.get_file_path(self.test_chat_id, day)
+            self.assertEqual(len(file_path.read_text(encoding='utf-8').splitlines()), 1)
+            self.assertEqual(storage._write_buffers, {})
+            self.assertIsNone(storage._flush_timer)
+
+    def test_storage_caches_loaded_days(self):
+        """测试读取过的日期缓存在内存中，新消息追加到缓存，删除文件时清除缓存"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = MessageStorage()
+            storage.data_dir = Path(temp_dir)
+            day = date(2024, 1, 2)
+
+            with patch('src.storage.message_storage.config') as mock_config:
+                mock_config.timezone_offset_hours = 0
+                storage.save_message(self.test_chat_id, {"user": "测试用户1", "text": "第一条", "date": datetime(2024, 1, 2, 9, 0)})
+                self.assertEqual(len(storage.load_messages(self.test_chat_id, day)), 1)
+
+                # 缓存的列表直接追加新消息，返回的是副本
+                storage.save_message(self.test_chat_id, {"user": "测试用户2", "text": "第二条", "date": datetime(2024, 1, 2, 9, 5)})
+                messages = storage.load_messages(self.test_chat_id, day)
+                messages.clear()
+                self.assertEqual([msg["user"] for msg in storage.load_messages(self.test_chat_id, day)],
+                                 ["测试用户1", "测试用户2"])
+
+                with patch('src.storage.message_storage.get_local_date_with_offset', return_value=date(2024, 3, 1)):
+                    storage.delete_old_messages(self.test_chat_id, days_to_keep=30)
+
+            self.assertEqual(storage.load_messages(self.test_chat_id, day), [])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest.mock import AsyncMock, patch
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ratelimit import AsyncRateLimiter
+
+
+class TestAsyncRateLimiter(unittest.TestCase):
+    def test_burst_then_wait(self):
+        """测试突发额度用完后按速率等待"""
+        limiter = AsyncRateLimiter(2, 1)
+
+        async def run():
+            with patch('src.ratelimit.time.monotonic', return_value=100.0), \
+                    patch('src.ratelimit.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+                limiter._last = 100.0
+                for _ in range(4):
+                    async with limiter:
+                        pass
+                return [call.args[0] for call in mock_sleep.await_args_list]
+
+        self.assertEqual(asyncio.run(run()), [0.5, 1.0])
+
+    def test_disabled_limiter_never_waits(self):
+        """测试max_rate为0时不限制"""
+        limiter = AsyncRateLimiter(0)
+
+        async def run():
+            with patch('src.ratelimit.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+                for _ in range(10):
+                    await limiter.acquire()
+                return mock_sleep.await_count
+
+        self.assertEqual(asyncio.run(run()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()